@@ -8,9 +8,10 @@ import logging
 from time import sleep
 import typer
 import uvicorn
-from .database.config import run_downgrade, run_upgrade
+from .database.config import get_sync_engine, run_downgrade, run_upgrade
+from .database.vector_indexes import manage_vector_indexes
 from .schemas import DbActions
-from .settings import get_settings, setup_logging
+from .settings import get_collection_dimensions, get_settings, setup_logging
 from .worker import work
 from .google.gmail import fetch_emails
 from .google.drive import enumerate_drive_files
@@ -82,6 +83,13 @@ def db(
         run_downgrade(settings.db_settings, revision)
     elif action == DbActions.UPGRADE:
         run_upgrade(settings.db_settings, revision)
+    elif action in (DbActions.INDEX, DbActions.REINDEX):
+        manage_vector_indexes(
+            get_sync_engine(settings.db_settings),
+            get_collection_dimensions(),
+            settings.vector_index_settings,
+            reindex=action == DbActions.REINDEX,
+        )
     else:
         raise ValueError("Invalid action")
 
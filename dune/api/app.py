@@ -2,6 +2,7 @@
 Create the FastApi application.
 """
 
+from contextlib import asynccontextmanager
 from urllib.parse import quote
 
 from fastapi import FastAPI, Request, Response
@@ -18,7 +19,14 @@ from .users import (
     cookie_backend,
     get_google_oauth_client,
 )
-from ..settings import get_user_settings
+from ..settings import get_user_settings, os_client_lifespan
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    """open the clients shared by every request"""
+    async with os_client_lifespan():
+        yield
 
 
 def create_app() -> FastAPI:
@@ -29,6 +37,7 @@ def create_app() -> FastAPI:
         title="Document Parser",
         description="Parses Documents",
         version="1.0",
+        lifespan=lifespan,
     )
 
     @app.middleware("http")
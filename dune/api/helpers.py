@@ -2,16 +2,25 @@
 Helper functions
 """
 
+from typing import AsyncIterator
 from uuid import UUID
 from fastapi import HTTPException, status
+from redis.asyncio import Redis
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from langchain_core.runnables.history import RunnableWithMessageHistory
-from ..settings import get_oai_vector_store, get_ollama_vector_store
-from ..gpt.settings import get_oai_client
-from ..ollama.settings import get_ollama_client
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.runnables import Runnable
+from ..settings import (
+    async_session_context,
+    get_oai_vector_store,
+    get_ollama_vector_store,
+)
+from ..gpt.settings import get_oai_client, get_oai_settings
+from ..ollama.settings import get_ollama_client, get_ollama_settings
 from ..database.models import User, UserSessionModel
 from ..database.chat_history_wrapper import SQLAlchemyChatMessageHistory
+from ..semantic_cache import store_answer
 from .schemas import Provider
 
 
@@ -42,19 +51,54 @@ def get_client_func(provider: Provider):
     }.get(provider, None)
 
 
-async def stream(message: str, session_id: int, runnable: RunnableWithMessageHistory):
-    """Stream response"""
-    async for item in runnable.astream(
-        {"question": message},
-        config={"configurable": {"session_id": session_id}},
-    ):
-        yield item.content
+def get_model_name(provider: Provider) -> str:
+    """returns the chat model configured for a given provider"""
+    return {
+        Provider.OLLAMA: lambda: get_ollama_settings().ollama_model.value,
+        Provider.OPENAI: lambda: get_oai_settings().openai_model.value,
+    }[provider]()
 
 
-def get_message_history_func(session: AsyncSession):
-    """Wrapper to make it work"""
+async def stream(
+    message: str, history: list[BaseMessage], session_id: int, chain: Runnable
+):
+    """
+    Stream response, then append the question and the answer to the history.
+    The request session is closed by the time the stream ends, so the turn is
+    written in its own transaction.
+    """
+    answer = []
+    async for item in chain.astream({"question": message, "history": history}):
+        answer.append(item.content)
+        yield item.content
+    async with async_session_context() as session:
+        await SQLAlchemyChatMessageHistory(
+            session_id, async_session=session
+        ).aadd_messages([HumanMessage(message), AIMessage("".join(answer))])
 
-    def _get_message_history(session_id: int):
-        return SQLAlchemyChatMessageHistory(session_id, async_session=session)
 
-    return _get_message_history
+async def cache_answer(
+    chunks: AsyncIterator[str],
+    redis_client: Redis,
+    user_id: UUID,
+    provider: Provider,
+    docs: list[Document],
+    history: list[BaseMessage],
+    embedding: list[float],
+):
+    """pass a streamed answer through and cache it once it completes"""
+    answer = []
+    async for chunk in chunks:
+        answer.append(chunk)
+        yield chunk
+    if text := "".join(answer):
+        await store_answer(
+            redis_client,
+            user_id,
+            provider,
+            get_model_name(provider),
+            docs,
+            history,
+            embedding,
+            text,
+        )
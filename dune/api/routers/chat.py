@@ -2,25 +2,39 @@
 GPT endpoints
 """
 
+import json
+from typing import Annotated
 from uuid import UUID
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from redis.asyncio import Redis
 from sqlalchemy.ext.asyncio import AsyncSession
-from langchain_postgres import PGVector
 from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.runnables.history import RunnableWithMessageHistory
 from ..users import current_active_user
-from ...database.models import User, UserSessionModel
+from ...database.models import ChatMessageModel, User, UserSessionModel
 from ...database.chat_history_wrapper import SQLAlchemyChatMessageHistory
-from ..schemas import PostMessage
-from ...settings import get_async_session
+from ..schemas import PostMessage, Provider
+from ...embeddings import CachedEmbeddings
+from ...context import build_context
+from ...history import WindowedChatMessageHistory, update_summary
+from ...semantic_cache import lookup_answer
+from ...database.config import get_async_engine
+from ...settings import (
+    get_async_session,
+    get_redis_client,
+    get_settings,
+)
+from ...vectors import retrieve
 from ..helpers import (
     validate_session,
     stream,
+    cache_answer,
     get_store_func,
     get_client_func,
-    get_message_history_func,
+    get_model_name,
 )
 
 router = APIRouter(
@@ -32,57 +46,113 @@ router = APIRouter(
 async def stream_endpoint(
     body: PostMessage,
     session: AsyncSession = Depends(get_async_session),
+    red: Redis = Depends(get_redis_client),
     user: User = Depends(current_active_user),
 ):
     """Stream response from thread"""
     session_info: UserSessionModel = await validate_session(
         body.session_id, user, session
     )
-    fetch_store = get_store_func(body.provider)
-    runnable = await parse_message(body, fetch_store(), session)
+    store = get_store_func(body.provider)()
+    docs: list[Document] = await retrieve(
+        session,
+        store,
+        body.message,
+        k=get_settings().retrieval_settings.retrieval_k,
+        user_id=user.id,
+        mode=body.retrieval_mode,
+    )
+    history = await WindowedChatMessageHistory(
+        session_info.id, async_session=session
+    ).aget_messages()
+    if body.use_cache:
+        embedding = await store.embeddings.aembed_query(body.message)
+        answer = await lookup_answer(
+            red,
+            user.id,
+            body.provider,
+            get_model_name(body.provider),
+            docs,
+            history,
+            embedding,
+        )
+        if answer is not None:
+            await SQLAlchemyChatMessageHistory(
+                session_info.id, async_session=session
+            ).aadd_messages([HumanMessage(body.message), AIMessage(answer)])
+            return StreamingResponse(iter([answer]), media_type="text/plain")
+    context = build_context(docs, get_model_name(body.provider))
+    response = stream(
+        body.message, history, session_info.id, parse_message(body, context.messages)
+    )
+    if body.use_cache:
+        response = cache_answer(
+            response, red, user.id, body.provider, docs, history, embedding
+        )
     return StreamingResponse(
-        stream(body.message, session_info.id, runnable),
+        response,
         media_type="text/plain",
+        headers=context.headers(),
+        background=BackgroundTask(
+            update_summary, session_info.id, get_client_func(body.provider)()
+        ),
     )
 
 
-async def parse_message(body: PostMessage, store: PGVector, session: AsyncSession):
-    """parse message"""
-    docs: list[Document] = await store.asimilarity_search(body.message, k=10)
+def parse_message(body: PostMessage, context: list[SystemMessage]):
+    """build the chain answering a message from the packed document context"""
     prompt = ChatPromptTemplate.from_messages(
         [
-            *[
-                ("system", f"document with id: {doc.id} has content {doc.page_content}")
-                for doc in docs
-            ],
+            *context,
             ("system", "You are a helpful assistant."),
             MessagesPlaceholder(variable_name="history"),
             ("human", "{question}"),
         ]
     )
-
-    chain = prompt | get_client_func(body.provider)()
-    return RunnableWithMessageHistory(
-        chain,
-        get_message_history_func(session),
-        input_messages_key="question",
-        history_messages_key="history",
-    )
+    return prompt | get_client_func(body.provider)()
 
 
 @router.get("/history")
 async def get_history(
     session_id: UUID,
+    before_id: int | None = None,
+    limit: Annotated[int | None, Query(gt=0, le=1000)] = None,
+    ndjson: bool = False,
     session: AsyncSession = Depends(get_async_session),
     user: User = Depends(current_active_user),
 ):
-    """Stream response from thread"""
+    """
+    Messages of a session in chronological order, paginated backwards with
+    `before_id` (the id of the oldest message already loaded) and `limit`.
+    With `ndjson` the page is streamed one message per line.
+    """
     session_info: UserSessionModel = await validate_session(session_id, user, session)
-    history = SQLAlchemyChatMessageHistory(session_info.id, async_session=session)
-    return [
-        {"content": item.content, "type": item.type}
-        for item in await history.aget_messages()
-    ]
+    stmt = ChatMessageModel.history_page_stmt(session_info.id, before_id, limit)
+    if ndjson:
+        return StreamingResponse(
+            stream_history(stmt), media_type="application/x-ndjson"
+        )
+    result = await session.execute(stmt)
+    return [history_item(row) for row in result]
+
+
+async def stream_history(stmt):
+    """
+    Stream history rows as ndjson from a server side cursor. Postgres only
+    declares cursors inside a transaction block, so the rows are read in a
+    read committed transaction instead of the engine's autocommit mode.
+    """
+    engine = get_async_engine(get_settings().db_settings)
+    async with engine.connect() as conn:
+        await conn.execution_options(isolation_level="READ COMMITTED")
+        async with conn.begin():
+            async for row in await conn.stream(stmt):
+                yield json.dumps(history_item(row)) + "\n"
+
+
+def history_item(row):
+    """history row as returned to the client"""
+    return {"id": row.id, "type": row.type, "content": row.content}
 
 
 @router.get("/session")
@@ -116,3 +186,15 @@ async def delete_session(
     return await session.execute(
         UserSessionModel.delete_session_stmt(user.id, session_id)
     )
+
+
+@router.get("/cache-stats")
+async def get_cache_stats():
+    """Query embedding cache hit and miss counters per provider"""
+    return {
+        provider: embeddings.query_stats.as_dict()
+        for provider in Provider
+        if isinstance(
+            embeddings := get_store_func(provider)().embeddings, CachedEmbeddings
+        )
+    }
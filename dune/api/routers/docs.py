@@ -2,16 +2,37 @@
 Document Manipulation endpoints
 """
 
-from typing import TYPE_CHECKING
-from datetime import timedelta
+import asyncio
+import logging
+from typing import TYPE_CHECKING, Annotated, Any, AsyncIterator
+from email.utils import format_datetime, parsedate_to_datetime
 from uuid import UUID, uuid4
 from redis.asyncio import Redis
-from fastapi import APIRouter, Depends, HTTPException, UploadFile
+from botocore.exceptions import ClientError
+from fastapi import (
+    APIRouter,
+    Depends,
+    Form,
+    HTTPException,
+    Request,
+    Response,
+    UploadFile,
+)
 from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from ...schemas import DocMetadataPayload
+from ...streams import publish_document, publish_documents
+from ...semantic_cache import invalidate_document
+from ...presigned_urls import get_presigned_url, invalidate_presigned_url
 from ...database.models import DocumentModel, User
+from ...object_storage import (
+    hash_upload_file,
+    iter_body,
+    read_upload_file,
+    upload_stream,
+)
 from ...settings import get_async_session, get_redis_client, get_os_client, get_settings
+from ..schemas import ExistingDocuments
 from ..users import current_active_user
 
 if TYPE_CHECKING:
@@ -45,85 +66,368 @@ async def check_document_exists(
     ).all()
 
 
+@router.post("/exists")
+async def find_existing_documents(
+    body: ExistingDocuments,
+    session: AsyncSession = Depends(get_async_session),
+    user: User = Depends(current_active_user),
+) -> ExistingDocuments:
+    """Which of the given filenames, content hashes and external ids exist"""
+    rows = (
+        await session.execute(
+            DocumentModel.find_existing_stmt(
+                user.id, body.filenames, body.content_hashes, body.external_ids
+            )
+        )
+    ).all()
+    names = {row.name for row in rows}
+    hashes = {row.content_hash for row in rows}
+    external_ids = {row.external_id for row in rows}
+    unlinked = {row.name for row in rows if row.external_id is None}
+    return ExistingDocuments(
+        filenames=[name for name in body.filenames if name in names],
+        content_hashes=[hash_ for hash_ in body.content_hashes if hash_ in hashes],
+        external_ids=[id_ for id_ in body.external_ids if id_ in external_ids],
+        unlinked_filenames=[name for name in body.filenames if name in unlinked],
+    )
+
+
 @router.get("/document/presigned-url")
 async def generate_presigned_url(
     id_: UUID,
     session: AsyncSession = Depends(get_async_session),
     client: "S3Client" = Depends(get_os_client),
+    red: Redis = Depends(get_redis_client),
     user: User = Depends(current_active_user),
 ):
     """
     Generate a presigned URL for accessing an object in the browser.
+    URLs are cached and reused until shortly before they expire.
     """
-    item = await session.scalar(DocumentModel.get_document_stmt(user.id, id_))
-    if not item:
-        raise HTTPException(status_code=404, detail="Object not found")
 
-    presigned_url = await client.generate_presigned_url(
-        "get_object",
-        Params={
-            "Bucket": get_settings().os_settings.os_bucket,
-            "Key": item.path,
-        },
-        ExpiresIn=int(timedelta(hours=1).total_seconds()),  # 1 hour in seconds
-    )
+    async def get_path():
+        return await session.scalar(
+            DocumentModel.get_document_stmt(user.id, id_).with_only_columns(
+                DocumentModel.path
+            )
+        )
+
+    presigned_url = await get_presigned_url(client, red, user.id, id_, get_path)
+    if presigned_url is None:
+        raise HTTPException(status_code=404, detail="Object not found")
     return {"url": presigned_url}
 
 
 @router.get("/document/download")
 async def download_document(
     id_: UUID,
+    request: Request,
     session: AsyncSession = Depends(get_async_session),
     client: "S3Client" = Depends(get_os_client),
     user: User = Depends(current_active_user),
 ):
     """
     Download an object from MinIO.
+    Range, If-None-Match and If-Modified-Since are passed through to object
+    storage, so partial content is answered with a 206 and unchanged objects
+    with a 304.
     """
     document = await session.scalar(DocumentModel.get_document_stmt(user.id, id_))
     if not document:
         raise HTTPException(status_code=404, detail="Object not found")
 
-    response = await client.get_object(
-        Bucket=get_settings().os_settings.os_bucket,
-        Key=document.path,
-    )
+    params: dict[str, Any] = {}
+    if range_ := request.headers.get("range"):
+        params["Range"] = range_
+    if etag := request.headers.get("if-none-match"):
+        params["IfNoneMatch"] = etag
+    if (since := request.headers.get("if-modified-since")) and not etag:
+        try:
+            params["IfModifiedSince"] = parsedate_to_datetime(since)
+        except (TypeError, ValueError):
+            pass
+    try:
+        response = await client.get_object(
+            Bucket=get_settings().os_settings.os_bucket, Key=document.path, **params
+        )
+    except ClientError as e:
+        status = e.response["ResponseMetadata"]["HTTPStatusCode"]
+        if status == 304:
+            return Response(status_code=304, headers=_caching_headers(e.response))
+        if status == 416:
+            raise HTTPException(416, "Range not satisfiable") from e
+        raise
+    headers = {
+        "Content-Disposition": f'attachment; filename="{document.name}"',
+        "Accept-Ranges": "bytes",
+        "Content-Length": str(response["ContentLength"]),
+        **_caching_headers(response),
+    }
+    if content_range := response.get("ContentRange"):
+        headers["Content-Range"] = content_range
     return StreamingResponse(
-        response,
+        iter_body(response["Body"], get_settings().os_settings.os_download_chunk_size),
+        status_code=206 if content_range else 200,
         media_type=document.type_,
-        headers={"Content-Disposition": f'attachment; filename="{document.name}"'},
+        headers=headers,
     )
 
 
+def upload_file_info(file: UploadFile) -> tuple[str, str]:
+    """filename and content type of an uploaded file"""
+    if not file.filename:
+        raise HTTPException(400, "Uploaded file has no filename")
+    return file.filename, file.content_type or "application/octet-stream"
+
+
+def _caching_headers(response: dict) -> dict[str, str]:
+    """validators of an object, from a get_object response or error"""
+    headers = {}
+    if etag := response.get("ETag"):
+        headers["ETag"] = etag
+    if last_modified := response.get("LastModified"):
+        headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+    if not headers:
+        http_headers = response.get("ResponseMetadata", {}).get("HTTPHeaders", {})
+        headers = {
+            name: http_headers[name.lower()]
+            for name in ("ETag", "Last-Modified")
+            if name.lower() in http_headers
+        }
+    return headers
+
+
 @router.post("/document")
 async def add_document(
     file: UploadFile,
+    external_id: Annotated[str | None, Form()] = None,
     session: AsyncSession = Depends(get_async_session),
     client: "S3Client" = Depends(get_os_client),
     red: Redis = Depends(get_redis_client),
     user: User = Depends(current_active_user),
 ):
     """add new document"""
-    id_ = uuid4()
-    path = f"{id_}_{file.filename}"
-    await client.put_object(
-        Bucket=get_settings().os_settings.os_bucket,
-        Key=path,
-        Body=file.file,
-        ContentType=file.content_type,
+    filename, content_type = upload_file_info(file)
+    chunks = read_upload_file(file, get_settings().os_settings.os_part_size)
+    return await store_document(
+        session,
+        client,
+        red,
+        user,
+        filename,
+        content_type,
+        chunks,
+        external_id,
+    )
+
+
+@router.post("/documents")
+async def add_documents(
+    files: list[UploadFile],
+    session: AsyncSession = Depends(get_async_session),
+    client: "S3Client" = Depends(get_os_client),
+    red: Redis = Depends(get_redis_client),
+    user: User = Depends(current_active_user),
+):
+    """
+    add many documents in one request. Files are hashed concurrently and
+    checked for duplicates with one query, the new ones are uploaded
+    concurrently, every row is recorded with one multi row upsert and the new
+    documents are queued with one pipelined call.
+    Returns a status per file, in order.
+    """
+    settings = get_settings().os_settings
+    if len(files) > settings.os_bulk_upload_max_files:
+        raise HTTPException(
+            413, f"At most {settings.os_bulk_upload_max_files} files per request"
+        )
+    infos = [upload_file_info(file) for file in files]
+    slots = asyncio.Semaphore(settings.os_bulk_upload_concurrency)
+
+    async def hash_file(file: UploadFile):
+        async with slots:
+            return await hash_upload_file(file, settings.os_part_size)
+
+    hashes = await asyncio.gather(*(hash_file(file) for file in files))
+    originals: dict[str, DocumentModel] = {}
+    named: dict[tuple[str, str | None], UUID] = {}  # (content, name) already recorded
+    for document in await session.scalars(
+        DocumentModel.get_documents_by_hash_stmt(user.id, list(set(hashes)))
+    ):
+        if document.content_hash is not None:
+            originals.setdefault(document.content_hash, document)
+            named[(document.content_hash, document.name)] = document.id_
+    statuses: list[dict] = [{"filename": filename} for filename, _ in infos]
+    new: dict[str, int] = {}  # first file of each new content
+    for index, sha256 in enumerate(hashes):
+        if sha256 not in originals:
+            new.setdefault(sha256, index)
+
+    async def upload(index: int):
+        filename, content_type = infos[index]
+        id_ = uuid4()
+        path = f"{id_}_{filename}"
+        async with slots:
+            await upload_stream(
+                client,
+                path,
+                read_upload_file(files[index], settings.os_part_size),
+                content_type,
+            )
+        return {
+            "user_id": user.id,
+            "id_": id_,
+            "name": filename,
+            "path": path,
+            "type_": content_type,
+            "content_hash": hashes[index],
+            "external_id": None,
+            "chunk_count": None,
+            "embedding_status": {},
+        }
+
+    results = await asyncio.gather(
+        *(upload(index) for index in new.values()), return_exceptions=True
+    )
+    documents = []
+    for index, result in zip(new.values(), results):
+        if isinstance(result, BaseException):
+            logging.error("Failed to upload %s: %s", infos[index][0], result)
+            statuses[index].update(status="failed", detail=str(result))
+            continue
+        documents.append(result)
+        originals[hashes[index]] = DocumentModel(**result)
+        named[(hashes[index], result["name"])] = result["id_"]
+        statuses[index].update(id_=result["id_"], status="created")
+    aliases = []
+    for index, sha256 in enumerate(hashes):
+        if "status" in statuses[index]:
+            continue
+        if (original := originals.get(sha256)) is None:  # its upload failed
+            statuses[index].update(statuses[new[sha256]] | statuses[index])
+            continue
+        filename, content_type = infos[index]
+        key = (sha256, filename)
+        if key not in named:
+            alias = alias_document(original, filename, content_type)
+            aliases.append(alias)
+            named[key] = alias["id_"]
+        statuses[index].update(id_=named[key], status="duplicate")
+    if documents or aliases:
+        await session.execute(DocumentModel.add_documents_stmt(documents + aliases))
+    if documents:
+        await publish_documents(
+            red,
+            [
+                DocMetadataPayload(
+                    id_=document["id_"],
+                    user_id=user.id,
+                    path=document["path"],
+                    type_=document["type_"],
+                )
+                for document in documents
+            ],
+        )
+    return statuses
+
+
+@router.put("/document/stream")
+async def stream_document(
+    filename: str,
+    request: Request,
+    external_id: str | None = None,
+    session: AsyncSession = Depends(get_async_session),
+    client: "S3Client" = Depends(get_os_client),
+    red: Redis = Depends(get_redis_client),
+    user: User = Depends(current_active_user),
+):
+    """
+    add new document from the raw request body, which is uploaded to object
+    storage as it arrives instead of being spooled first
+    """
+    content_type = request.headers.get("content-type", "application/octet-stream")
+    return await store_document(
+        session,
+        client,
+        red,
+        user,
+        filename,
+        content_type,
+        request.stream(),
+        external_id,
     )
+
+
+async def store_document(
+    session: AsyncSession,
+    client: "S3Client",
+    red: Redis,
+    user: User,
+    filename: str,
+    content_type: str,
+    chunks: AsyncIterator[bytes],
+    external_id: str | None = None,
+):
+    """
+    upload a document, record it and queue it for ingestion. When the user
+    already has a document with the same content the upload is abandoned and
+    the new name is recorded as a duplicate sharing the existing document's
+    object and embeddings, unless a document with that name and external id
+    already exists.
+    """
+    id_ = uuid4()
+    path = f"{id_}_{filename}"
+    originals: list[DocumentModel] = []
+
+    async def is_new(sha256: str):
+        originals.extend(
+            await session.scalars(
+                DocumentModel.get_documents_by_hash_stmt(user.id, [sha256])
+            )
+        )
+        return not originals
+
+    result = await upload_stream(client, path, chunks, content_type, keep=is_new)
+    if not result.stored:
+        for original in originals:
+            if original.name == filename and original.external_id == external_id:
+                return {"id_": original.id_, "duplicate": True}
+        alias = alias_document(originals[0], filename, content_type, external_id)
+        await session.execute(DocumentModel.add_documents_stmt([alias]))
+        return {"id_": alias["id_"], "duplicate": True}
     await session.execute(
         DocumentModel.add_document_stmt(
-            user.id, id_, file.filename, path, file.content_type
+            user.id, id_, filename, path, content_type, result.sha256, external_id
         )
     )
-    await red.publish(
-        get_settings().red_settings.subscription_name,
-        DocMetadataPayload(
-            id_=id_, path=path, type_=file.content_type
-        ).model_dump_json(),
+    await publish_document(
+        red,
+        DocMetadataPayload(id_=id_, user_id=user.id, path=path, type_=content_type),
     )
-    return {"id_": id_}
+    return {"id_": id_, "duplicate": False}
+
+
+def alias_document(
+    original: DocumentModel,
+    name: str | None,
+    type_: str | None,
+    external_id: str | None = None,
+) -> dict:
+    """
+    row of a duplicate upload, pointing at the object and embeddings of the
+    document with the same content
+    """
+    return {
+        "user_id": original.user_id,
+        "id_": uuid4(),
+        "name": name,
+        "path": original.path,
+        "type_": type_,
+        "content_hash": original.content_hash,
+        "external_id": external_id,
+        "chunk_count": original.chunk_count,
+        "embedding_status": original.embedding_status or {},
+    }
 
 
 @router.delete("/document")
@@ -131,14 +435,29 @@ async def delete_document(
     id_: UUID,
     session: AsyncSession = Depends(get_async_session),
     client: "S3Client" = Depends(get_os_client),
+    red: Redis = Depends(get_redis_client),
     user: User = Depends(current_active_user),
 ):
-    """add new document"""
-    path: str | None = await session.scalar(
-        DocumentModel.delete_document_stmt(user.id, id_).returning(DocumentModel.path)
-    )
-    if not path:
+    """
+    delete a document. Its object is kept while duplicates of the document
+    still point at it.
+    """
+    deleted = (
+        await session.execute(
+            DocumentModel.delete_document_stmt(user.id, id_).returning(
+                DocumentModel.path, DocumentModel.content_hash
+            )
+        )
+    ).first()
+    if deleted is None:
         raise HTTPException(404, "Object not found")
-    await client.delete_object(Bucket=get_settings().os_settings.os_bucket, Key=path)
+    if not await session.scalar(
+        DocumentModel.path_in_use_stmt(user.id, deleted.path, deleted.content_hash)
+    ):
+        await client.delete_object(
+            Bucket=get_settings().os_settings.os_bucket, Key=deleted.path
+        )
+    await invalidate_document(red, str(id_))
+    await invalidate_presigned_url(red, user.id, id_)
 
     return {"detail": "success"}
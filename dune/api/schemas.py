@@ -2,15 +2,8 @@
 API Schemas
 """
 
-from enum import StrEnum
 from pydantic import BaseModel
-
-
-class Provider(StrEnum):
-    """Provider options"""
-
-    OPENAI = "openai"
-    OLLAMA = "ollama"
+from ..schemas import Provider, RetrievalMode
 
 
 class PostMessage(BaseModel):
@@ -19,3 +12,16 @@ class PostMessage(BaseModel):
     message: str
     session_id: str
     provider: Provider
+    retrieval_mode: RetrievalMode = RetrievalMode.HYBRID
+    use_cache: bool = False  # replay a cached answer to a similar question
+
+
+class ExistingDocuments(BaseModel):
+    """Document lookup body and response, by any of the keys"""
+
+    filenames: list[str] = []
+    content_hashes: list[str] = []
+    external_ids: list[str] = []
+    # response only, filenames matching documents recorded without an external
+    # id, e.g. synced before external ids were stored
+    unlinked_filenames: list[str] = []
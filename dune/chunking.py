@@ -0,0 +1,75 @@
+"""
+Splitting of parsed documents into chunks sized for embedding
+"""
+
+from functools import lru_cache
+
+import tiktoken
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from .settings import get_settings
+
+
+@lru_cache
+def get_encoding():
+    """return the tokenizer used to measure chunks"""
+    return tiktoken.get_encoding(get_settings().chunk_settings.chunk_encoding)
+
+
+def count_tokens(text: str) -> int:
+    """number of tokens in a piece of text"""
+    return len(get_encoding().encode(text, disallowed_special=()))
+
+
+@lru_cache
+def get_text_splitter():
+    """return a token aware recursive splitter"""
+    settings = get_settings().chunk_settings
+    return RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        encoding_name=settings.chunk_encoding,
+        chunk_size=settings.chunk_size,
+        chunk_overlap=settings.chunk_overlap,
+    )
+
+
+def merge_small_chunks(
+    chunks: list[Document], min_size: int, max_size: int
+) -> list[Document]:
+    """
+    Merge neighbouring chunks of the same source when one of them is smaller
+    than `min_size` tokens, as long as the result stays within `max_size`.
+    """
+    merged: list[tuple[Document, int]] = []
+    for chunk in chunks:
+        size = count_tokens(chunk.page_content)
+        if merged:
+            previous, previous_size = merged[-1]
+            if (
+                previous.metadata.get("source") == chunk.metadata.get("source")
+                and min(previous_size, size) < min_size
+                and previous_size + size <= max_size
+            ):
+                previous.page_content = (
+                    f"{previous.page_content}\n\n{chunk.page_content}"
+                )
+                merged[-1] = (previous, previous_size + size)
+                continue
+        merged.append(
+            (Document(page_content=chunk.page_content, metadata=chunk.metadata), size)
+        )
+    return [chunk for chunk, _ in merged]
+
+
+def chunk_documents(documents: list[Document]) -> list[Document]:
+    """split documents into chunks and number them in order"""
+    settings = get_settings().chunk_settings
+    chunks = [
+        chunk
+        for chunk in get_text_splitter().split_documents(documents)
+        if chunk.page_content.strip()
+    ]
+    chunks = merge_small_chunks(chunks, settings.chunk_min_size, settings.chunk_size)
+    for index, chunk in enumerate(chunks):
+        chunk.metadata = {**chunk.metadata, "chunk_index": index}
+    return chunks
@@ -0,0 +1,171 @@
+"""
+Packing of retrieved chunks into the prompt context.
+
+Retrieved chunks are deduplicated, neighbouring chunks of the same document
+are stitched back together and the resulting passages are added in relevance
+order until the model's token budget is spent.
+"""
+
+from dataclasses import dataclass, field
+import logging
+import re
+
+from langchain_core.documents import Document
+from langchain_core.messages import SystemMessage
+
+from .chunking import count_tokens
+from .settings import get_settings
+
+WORD = re.compile(r"\w+")
+
+
+@dataclass
+class Passage:
+    """consecutive chunks of one document"""
+
+    rank: int  # best retrieval rank of its chunks
+    document_id: str | None
+    chunk_index: int | None
+    content: str
+    ids: list[str] = field(default_factory=list)
+
+
+@dataclass
+class Context:
+    """prompt context built from retrieved chunks"""
+
+    messages: list[SystemMessage]
+    budget: int
+    tokens: int
+    retrieved: int  # chunks returned by retrieval
+    packed: int  # chunks that made it into the prompt
+
+    def headers(self) -> dict[str, str]:
+        """token accounting as response headers"""
+        return {
+            "X-Context-Budget": str(self.budget),
+            "X-Context-Tokens": str(self.tokens),
+            "X-Context-Chunks": f"{self.packed}/{self.retrieved}",
+        }
+
+
+def shingles(text: str, size: int = 3) -> set[tuple[str, ...]]:
+    """word n-grams of a text, used to compare chunks"""
+    words = WORD.findall(text.casefold())
+    if len(words) < size:
+        return {tuple(words)}
+    return {tuple(words[i : i + size]) for i in range(len(words) - size + 1)}
+
+
+def deduplicate(docs: list[Document], threshold: float) -> list[Document]:
+    """
+    drop chunks whose word shingles overlap a more relevant chunk's by at
+    least `threshold` (jaccard similarity)
+    """
+    kept: list[tuple[Document, set]] = []
+    for doc in docs:
+        current = shingles(doc.page_content)
+        if any(
+            len(current & other) / (len(current | other) or 1) >= threshold
+            for _, other in kept
+        ):
+            continue
+        kept.append((doc, current))
+    return [doc for doc, _ in kept]
+
+
+def join_overlapping(first: str, second: str, min_words: int = 1) -> str:
+    """
+    concatenate two consecutive chunks, dropping the text they share. The
+    splitter overlaps chunks by whole words, so shared text that cuts through
+    a word or is shorter than `min_words` words is a coincidence and the
+    chunks are joined with a newline instead.
+    """
+    for size in range(min(len(first), len(second)), 0, -1):
+        overlap = second[:size]
+        if (
+            first.endswith(overlap)
+            and (size == len(first) or not WORD.match(first[-size - 1]))
+            and not WORD.match(second, size)
+            and len(WORD.findall(overlap)) >= min_words
+        ):
+            return first + second[size:]
+    return f"{first}\n{second}"
+
+
+def merge_adjacent(docs: list[Document], min_overlap_words: int = 1) -> list[Passage]:
+    """merge chunks of the same document with consecutive chunk indexes"""
+    passages = [
+        Passage(
+            rank=rank,
+            document_id=doc.metadata.get("document_id"),
+            chunk_index=doc.metadata.get("chunk_index"),
+            content=doc.page_content,
+            ids=[str(doc.id)],
+        )
+        for rank, doc in enumerate(docs)
+    ]
+    ordered = sorted(
+        passages,
+        key=lambda p: (
+            p.document_id is None,
+            p.document_id or "",
+            p.chunk_index is None,
+            p.chunk_index or 0,
+        ),
+    )
+    merged: list[Passage] = []
+    for passage in ordered:
+        previous = merged[-1] if merged else None
+        if (
+            previous is not None
+            and passage.document_id is not None
+            and previous.document_id == passage.document_id
+            and passage.chunk_index is not None
+            and previous.chunk_index is not None
+            and passage.chunk_index == previous.chunk_index + 1
+        ):
+            previous.content = join_overlapping(
+                previous.content, passage.content, min_overlap_words
+            )
+            previous.chunk_index = passage.chunk_index
+            previous.rank = min(previous.rank, passage.rank)
+            previous.ids.extend(passage.ids)
+            continue
+        merged.append(passage)
+    return sorted(merged, key=lambda p: p.rank)
+
+
+def get_context_budget(model: str) -> int:
+    """prompt tokens available to retrieved documents for a model"""
+    settings = get_settings().context_settings
+    return settings.context_budgets.get(model, settings.context_default_budget)
+
+
+def build_context(docs: list[Document], model: str) -> Context:
+    """pack retrieved chunks, most relevant first, into the model's budget"""
+    settings = get_settings().context_settings
+    budget = get_context_budget(model)
+    tokens, packed, messages = 0, 0, []
+    unique = deduplicate(docs, settings.context_dedup_threshold)
+    for passage in merge_adjacent(unique, settings.context_min_overlap_words):
+        content = (
+            f"document with id: {', '.join(passage.ids)} has content {passage.content}"
+        )
+        size = count_tokens(content)
+        if tokens + size > budget:
+            continue
+        messages.append(SystemMessage(content=content))
+        tokens += size
+        packed += len(passage.ids)
+    context = Context(messages, budget, tokens, retrieved=len(docs), packed=packed)
+    logging.info(
+        "Context for %s: %s/%s tokens, %s of %s chunks (%s duplicates)",
+        model,
+        tokens,
+        budget,
+        packed,
+        len(docs),
+        len(docs) - len(unique),
+    )
+    return context
@@ -0,0 +1,39 @@
+"""embedding user index
+
+Revision ID: 4e7b2c9d1a85
+Revises: d83f0b6a2e71
+Create Date: 2026-10-17 12:41:18.207655
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "4e7b2c9d1a85"
+down_revision: Union[str, None] = "d83f0b6a2e71"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # chunks embedded before user_id was stamped are matched to their
+    # document through the s3://bucket/path source set by the loader
+    op.execute("""
+        UPDATE langchain_pg_embedding AS e
+        SET cmetadata = coalesce(e.cmetadata, '{}'::jsonb) || jsonb_build_object(
+            'user_id', d.user_id::text, 'document_id', d.id_::text
+        )
+        FROM documents AS d
+        WHERE e.cmetadata->>'user_id' IS NULL
+        AND right(e.cmetadata->>'source', length(d.path) + 1) = '/' || d.path
+        """)
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_langchain_pg_embedding_user_id"
+        " ON langchain_pg_embedding (collection_id, (cmetadata->>'user_id'))"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_langchain_pg_embedding_user_id")
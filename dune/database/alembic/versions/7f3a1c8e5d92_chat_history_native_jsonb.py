@@ -0,0 +1,32 @@
+"""chat history native jsonb
+
+Revision ID: 7f3a1c8e5d92
+Revises: e2c5a9f13b47
+Create Date: 2026-10-17 15:48:26.190537
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "7f3a1c8e5d92"
+down_revision: Union[str, None] = "e2c5a9f13b47"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # messages used to be stored as json encoded strings inside the jsonb column
+    op.execute(
+        "UPDATE chat_history SET message = (message #>> '{}')::jsonb"
+        " WHERE jsonb_typeof(message) = 'string'"
+    )
+
+
+def downgrade() -> None:
+    op.execute(
+        "UPDATE chat_history SET message = to_jsonb(message::text)"
+        " WHERE jsonb_typeof(message) = 'object'"
+    )
@@ -0,0 +1,29 @@
+"""embedding document index
+
+Revision ID: a3f8d61c2e90
+Revises: 8c4f2a7e9b31
+Create Date: 2026-10-17 23:12:40.518326
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "a3f8d61c2e90"
+down_revision: Union[str, None] = "8c4f2a7e9b31"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # re-ingesting a document deletes its previous chunks by document id
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_langchain_pg_embedding_document_id"
+        " ON langchain_pg_embedding (collection_id, (cmetadata->>'document_id'))"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_langchain_pg_embedding_document_id")
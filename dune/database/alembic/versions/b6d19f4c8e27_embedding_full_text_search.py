@@ -0,0 +1,34 @@
+"""embedding full text search
+
+Revision ID: b6d19f4c8e27
+Revises: 4e7b2c9d1a85
+Create Date: 2026-10-17 13:55:40.611902
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "b6d19f4c8e27"
+down_revision: Union[str, None] = "4e7b2c9d1a85"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(
+        "ALTER TABLE langchain_pg_embedding ADD COLUMN IF NOT EXISTS document_tsv"
+        " tsvector GENERATED ALWAYS AS"
+        " (to_tsvector('english', coalesce(document, ''))) STORED"
+    )
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_langchain_pg_embedding_document_tsv"
+        " ON langchain_pg_embedding USING gin (document_tsv)"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_langchain_pg_embedding_document_tsv")
+    op.execute("ALTER TABLE langchain_pg_embedding DROP COLUMN IF EXISTS document_tsv")
@@ -0,0 +1,63 @@
+"""vector indexes
+
+Revision ID: d83f0b6a2e71
+Revises: 9a41d7e3b6c0
+Create Date: 2026-10-17 11:27:05.933412
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "d83f0b6a2e71"
+down_revision: Union[str, None] = "9a41d7e3b6c0"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # langchain_postgres creates these lazily, create them up front so the
+    # collections exist to be indexed. The vector indexes themselves depend on
+    # the configured embeddings and are built concurrently by `dune db -a index`
+    op.execute("CREATE EXTENSION IF NOT EXISTS vector")
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS langchain_pg_collection (
+            uuid UUID PRIMARY KEY,
+            name VARCHAR NOT NULL UNIQUE,
+            cmetadata JSON
+        )
+        """)
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS langchain_pg_embedding (
+            id VARCHAR PRIMARY KEY,
+            collection_id UUID
+                REFERENCES langchain_pg_collection (uuid) ON DELETE CASCADE,
+            embedding VECTOR,
+            document VARCHAR,
+            cmetadata JSONB
+        )
+        """)
+    op.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_langchain_pg_embedding_id"
+        " ON langchain_pg_embedding (id)"
+    )
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_cmetadata_gin"
+        " ON langchain_pg_embedding USING gin (cmetadata jsonb_path_ops)"
+    )
+
+
+def downgrade() -> None:
+    indexes = op.get_bind().execute(
+        sa.text(
+            "SELECT indexname FROM pg_indexes"
+            " WHERE tablename = 'langchain_pg_embedding'"
+            " AND (indexdef LIKE '% USING hnsw %'"
+            " OR indexdef LIKE '% USING ivfflat %')"
+        )
+    )
+    for (name,) in indexes.all():
+        op.execute(f"DROP INDEX IF EXISTS {name}")
@@ -2,7 +2,6 @@
 Stand-in replacement for the postgres chat message history
 """
 
-import json
 from typing import List, Sequence, Optional
 
 from sqlalchemy import select, delete
@@ -34,68 +33,85 @@ class SQLAlchemyChatMessageHistory(PostgresChatMessageHistory):
         if not session and not async_session:
             raise ValueError("Must provide a sync Session or an async Session")
         self._table_model = ChatMessageModel
-        self._session_id = int(session_id)
+        self._session_id = str(session_id)
         self._session = session
         self._async_session = async_session
 
+    @property
+    def chat_session_id(self) -> int:
+        """id of the chat session, the base class types it as a string"""
+        return int(self._session_id)
+
+    def _get_session(self) -> Session:
+        if self._session is None:
+            raise ValueError("Must provide a sync Session")
+        return self._session
+
+    def _get_async_session(self) -> AsyncSession:
+        if self._async_session is None:
+            raise ValueError("Must provide an async Session")
+        return self._async_session
+
     def add_messages(self, messages: Sequence[BaseMessage]) -> None:
         """Add messages using a synchronous SQLAlchemy Session."""
-        values = [
-            self._table_model(
-                session_id=self._session_id,
-                message=json.dumps(message_to_dict(message)),
+        session = self._get_session()
+        session.execute(
+            self._table_model.add_messages_stmt(
+                self.chat_session_id,
+                [message_to_dict(message) for message in messages],
             )
-            for message in messages
-        ]
-        self._session.add_all(values)
-        self._session.commit()
+        )
+        session.commit()
 
     async def aadd_messages(self, messages: Sequence[BaseMessage]) -> None:
-        """Add messages using an asynchronous SQLAlchemy Session."""
-        values = [
-            self._table_model(
-                session_id=self._session_id,
-                message=json.dumps(message_to_dict(message)),
+        """
+        Add messages using an asynchronous SQLAlchemy Session, in a single
+        multi row INSERT. The caller's transaction commits them.
+        """
+        await self._get_async_session().execute(
+            self._table_model.add_messages_stmt(
+                self.chat_session_id,
+                [message_to_dict(message) for message in messages],
             )
-            for message in messages
-        ]
-        self._async_session.add_all(values)
-        await self._async_session.commit()
+        )
 
     def get_messages(self) -> List[BaseMessage]:
         """Retrieve messages using a synchronous SQLAlchemy Session."""
         query = (
-            self._session.query(self._table_model)
-            .filter(self._table_model.session_id == self._session_id)
+            self._get_session()
+            .query(self._table_model)
+            .filter(self._table_model.session_id == self.chat_session_id)
             .order_by(self._table_model.id)
         )
         records = query.all()
-        items = [json.loads(record.message) for record in records]
+        items = [record.message for record in records]
         return messages_from_dict(items)
 
     async def aget_messages(self) -> List[BaseMessage]:
         """Retrieve messages using an asynchronous SQLAlchemy Session."""
         stmt = (
             select(self._table_model)
-            .where(self._table_model.session_id == self._session_id)
+            .where(self._table_model.session_id == self.chat_session_id)
             .order_by(self._table_model.id)
         )
-        result = await self._async_session.execute(stmt)
+        result = await self._get_async_session().execute(stmt)
         records = result.scalars().all()
-        items = [json.loads(record.message) for record in records]
+        items = [record.message for record in records]
         return messages_from_dict(items)
 
     def clear(self) -> None:
         """Clear chat history synchronously using a SQLAlchemy Session."""
-        self._session.query(self._table_model).filter(
-            self._table_model.session_id == self._session_id
+        session = self._get_session()
+        session.query(self._table_model).filter(
+            self._table_model.session_id == self.chat_session_id
         ).delete()
-        self._session.commit()
+        session.commit()
 
     async def aclear(self) -> None:
         """Clear chat history asynchronously using a SQLAlchemy Session."""
+        session = self._get_async_session()
         stmt = delete(self._table_model).where(
-            self._table_model.session_id == self._session_id
+            self._table_model.session_id == self.chat_session_id
         )
-        await self._async_session.execute(stmt)
-        await self._async_session.commit()
+        await session.execute(stmt)
+        await session.commit()
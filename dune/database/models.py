@@ -3,10 +3,28 @@ Postgres Database table definitions
 """
 
 from datetime import datetime, timezone
+from typing import TypeVar
 from uuid import UUID, uuid4
 
-from sqlalchemy import delete, exists, func, select, update, ForeignKey, Index
-from sqlalchemy.orm import Mapped, relationship, DeclarativeBase, mapped_column
+from sqlalchemy import (
+    delete,
+    exists,
+    func,
+    or_,
+    select,
+    text,
+    tuple_,
+    update,
+    ForeignKey,
+    Index,
+)
+from sqlalchemy.orm import (
+    Mapped,
+    relationship,
+    DeclarativeBase,
+    aliased,
+    mapped_column,
+)
 from sqlalchemy.dialects.postgresql import insert, JSONB
 
 from fastapi_users.db import (
@@ -20,6 +38,15 @@ class BaseSql(DeclarativeBase):
     """base of models"""
 
 
+class UserOwned:
+    """mixin of models whose rows belong to a user"""
+
+    user_id: Mapped[UUID]
+
+
+OwnedModel = TypeVar("OwnedModel", bound=UserOwned)
+
+
 class AccessToken(SQLAlchemyBaseAccessTokenTableUUID, BaseSql):
     """Storing access tokens in the database"""
 
@@ -36,7 +63,7 @@ class User(SQLAlchemyBaseUserTableUUID, BaseSql):
     )
 
 
-class UserSessionModel(BaseSql):
+class UserSessionModel(UserOwned, BaseSql):
     """User session mapping"""
 
     __tablename__ = "user_sessions"
@@ -94,19 +121,112 @@ class ChatMessageModel(BaseSql):
     message: Mapped[dict] = mapped_column(type_=JSONB)
     created_at: Mapped[datetime] = mapped_column(server_default=func.now())
 
+    @classmethod
+    def add_messages_stmt(cls, session_id: int, messages: list[dict]):
+        """Append messages to a session in a single multi row insert"""
+        return insert(cls).values(
+            [{"session_id": session_id, "message": m} for m in messages]
+        )
+
+    @classmethod
+    def recent_messages_stmt(cls, session_id: int, limit: int):
+        """Newest messages of a session first, served by the (session_id, id) index"""
+        return (
+            select(cls.id, cls.message)
+            .where(cls.session_id == session_id)
+            .order_by(cls.id.desc())
+            .limit(limit)
+        )
+
+    @classmethod
+    def history_page_stmt(
+        cls, session_id: int, before_id: int | None = None, limit: int | None = None
+    ):
+        """
+        Messages of a session older than `before_id`, the newest `limit` of them
+        in chronological order. Only the id, type and content are selected.
+        """
+        stmt = select(
+            cls.id,
+            cls.message["type"].astext.label("type"),
+            cls.message["data"]["content"].label("content"),
+        ).where(cls.session_id == session_id)
+        if before_id is not None:
+            stmt = stmt.where(cls.id < before_id)
+        if limit is None:
+            return stmt.order_by(cls.id)
+        page = stmt.order_by(cls.id.desc()).limit(limit).subquery()
+        return select(page).order_by(page.c.id)
+
+    @classmethod
+    def messages_between_stmt(
+        cls, session_id: int, after_id: int, before_id: int | None, limit: int
+    ):
+        """Oldest messages of a session in (after_id, before_id)"""
+        stmt = select(cls.id, cls.message).where(
+            cls.session_id == session_id, cls.id > after_id
+        )
+        if before_id is not None:
+            stmt = stmt.where(cls.id < before_id)
+        return stmt.order_by(cls.id).limit(limit)
+
+
+Index(
+    "ix_chat_history_session_id_id",
+    ChatMessageModel.session_id,
+    ChatMessageModel.id.desc(),
+)
+
+
+class ChatSummaryModel(BaseSql):
+    """Rolling summary of the messages of a session outside the history window"""
+
+    __tablename__ = "chat_summaries"
+
+    session_id: Mapped[int] = mapped_column(
+        ForeignKey(UserSessionModel.id, ondelete="CASCADE"), primary_key=True
+    )
+    summary: Mapped[str]
+    last_message_id: Mapped[int]  # newest message included in the summary
+    updated_at: Mapped[datetime] = mapped_column(server_default=func.now())
+
+    @classmethod
+    def get_summary_stmt(cls, session_id: int):
+        """Summary of a session"""
+        return select(cls).where(cls.session_id == session_id)
+
+    @classmethod
+    def upsert_summary_stmt(cls, session_id: int, summary: str, last_message_id: int):
+        """Add or replace the summary of a session"""
+        stmt = insert(cls).values(
+            session_id=session_id, summary=summary, last_message_id=last_message_id
+        )
+        return stmt.on_conflict_do_update(
+            index_elements=[cls.session_id],
+            set_={
+                "summary": stmt.excluded.summary,
+                "last_message_id": stmt.excluded.last_message_id,
+                "updated_at": func.now(),
+            },
+        )
+
 
-class DocumentModel(BaseSql):
+class DocumentModel(UserOwned, BaseSql):
     """Document table definition"""
 
     __tablename__ = "documents"
-    user_id: Mapped[UUID] = mapped_column(
-        ForeignKey(User.id, ondelete="CASCADE"), unique=True
-    )
+    user_id: Mapped[UUID] = mapped_column(ForeignKey(User.id, ondelete="CASCADE"))
     id_: Mapped[UUID] = mapped_column(primary_key=True)
     name: Mapped[str]
     path: Mapped[str]
     type_: Mapped[str]
     metad: Mapped[dict | None] = mapped_column(type_=JSONB, default=None)
+    embedding_status: Mapped[dict] = mapped_column(
+        type_=JSONB, server_default=text("'{}'::jsonb")
+    )
+    chunk_count: Mapped[int | None] = mapped_column(default=None)
+    content_hash: Mapped[str | None] = mapped_column(default=None)  # sha256 hex
+    external_id: Mapped[str | None] = mapped_column(default=None)  # e.g. drive id
     created_at: Mapped[datetime] = mapped_column(default=datetime.now(timezone.utc))
     modified_at: Mapped[datetime] = mapped_column(default=datetime.now(timezone.utc))
 
@@ -117,18 +237,78 @@ class DocumentModel(BaseSql):
             update_for_user(user_id, cls).where(cls.id_ == id_).values(metad=metadata)
         )
 
+    @classmethod
+    def same_object_clause(cls, id_: UUID):
+        """A document and the duplicates that share its object and embeddings"""
+        document = aliased(cls)
+        return or_(
+            cls.id_ == id_,
+            tuple_(cls.user_id, cls.content_hash, cls.path).in_(
+                select(document.user_id, document.content_hash, document.path).where(
+                    document.id_ == id_
+                )
+            ),
+        )
+
+    @classmethod
+    def set_embedding_status_stmt(cls, id_: UUID, provider: str, status: str):
+        """Record the embedding status of one provider"""
+        return (
+            update(cls)
+            .where(cls.same_object_clause(id_))
+            .values(
+                embedding_status=cls.embedding_status.op("||")(
+                    func.jsonb_build_object(provider, status)
+                )
+            )
+        )
+
+    @classmethod
+    def get_embedding_status_stmt(cls, id_: UUID):
+        """Get the embedding status of every provider"""
+        return select(cls.embedding_status).where(cls.id_ == id_)
+
+    @classmethod
+    def set_chunk_count_stmt(cls, id_: UUID, chunk_count: int):
+        """Record how many chunks a document was split into"""
+        return (
+            update(cls)
+            .where(cls.same_object_clause(id_))
+            .values(chunk_count=chunk_count)
+        )
+
     @classmethod
     def add_document_stmt(
-        cls, user_id: UUID, id_: UUID, name: str, path: str, type_: str
+        cls,
+        user_id: UUID,
+        id_: UUID,
+        name: str,
+        path: str,
+        type_: str,
+        content_hash: str | None = None,
+        external_id: str | None = None,
     ):
         """Add or update document"""
+        return cls.add_documents_stmt(
+            [
+                {
+                    "user_id": user_id,
+                    "id_": id_,
+                    "name": name,
+                    "path": path,
+                    "type_": type_,
+                    "content_hash": content_hash,
+                    "external_id": external_id,
+                }
+            ]
+        )
+
+    @classmethod
+    def add_documents_stmt(cls, documents: list[dict]):
+        """Add or update many documents in a single multi row upsert"""
+        modified_at = datetime.now(timezone.utc)
         stmt = insert(cls).values(
-            user_id=user_id,
-            id_=id_,
-            name=name,
-            path=path,
-            type_=type_,
-            modified_at=datetime.now(timezone.utc),
+            [{**document, "modified_at": modified_at} for document in documents]
         )
         return stmt.on_conflict_do_update(
             index_elements=cls.__mapper__.primary_key,
@@ -139,6 +319,22 @@ class DocumentModel(BaseSql):
             },
         )
 
+    @classmethod
+    def get_documents_by_hash_stmt(cls, user_id: UUID, content_hashes: list[str]):
+        """The user's documents with any of the given contents"""
+        return select_for_user(user_id, cls).where(cls.content_hash.in_(content_hashes))
+
+    @classmethod
+    def path_in_use_stmt(cls, user_id: UUID, path: str, content_hash: str | None):
+        """Whether any document of the user still points at an object"""
+        return select(
+            exists().where(
+                cls.user_id == user_id,
+                cls.content_hash == content_hash,
+                cls.path == path,
+            )
+        )
+
     @classmethod
     def delete_document_stmt(cls, user_id: UUID, id_: UUID):
         """Add or update document"""
@@ -157,30 +353,58 @@ class DocumentModel(BaseSql):
         """Add or update document"""
         return select_for_user(user_id, cls).where(cls.id_ == id_)
 
+    @classmethod
+    def find_existing_stmt(
+        cls,
+        user_id: UUID,
+        names: list[str],
+        content_hashes: list[str],
+        external_ids: list[str],
+    ):
+        """Documents of the user matching any of the names, hashes or external ids"""
+        return select(cls.name, cls.content_hash, cls.external_id).where(
+            cls.user_id == user_id,
+            or_(
+                cls.name.in_(names),
+                cls.content_hash.in_(content_hashes),
+                cls.external_id.in_(external_ids),
+            ),
+        )
+
     @classmethod
     def get_document_name_stmt(cls, user_id: UUID, name: str):
         """Add or update document"""
         return select_for_user(user_id, cls).where(cls.name == name)
 
 
-OwnedModel = type[DocumentModel]
+Index(
+    "ix_documents_user_id_content_hash",
+    DocumentModel.user_id,
+    DocumentModel.content_hash,
+)
+Index("ix_documents_user_id_name", DocumentModel.user_id, DocumentModel.name)
+Index(
+    "ix_documents_user_id_external_id",
+    DocumentModel.user_id,
+    DocumentModel.external_id,
+)
 
 
-def select_exists_for_user(user_id: UUID, model: OwnedModel):
+def select_exists_for_user(user_id: UUID, model: type[OwnedModel]):
     """select with user"""
     return select(exists(model)).where(model.user_id == user_id)
 
 
-def select_for_user(user_id: UUID, model: OwnedModel):
+def select_for_user(user_id: UUID, model: type[OwnedModel]):
     """select with user"""
     return select(model).where(model.user_id == user_id)
 
 
-def delete_for_user(user_id: UUID, model: OwnedModel):
+def delete_for_user(user_id: UUID, model: type[OwnedModel]):
     """select with user"""
     return delete(model).where(model.user_id == user_id)
 
 
-def update_for_user(user_id: UUID, model: OwnedModel):
+def update_for_user(user_id: UUID, model: type[OwnedModel]):
     """select with user"""
     return update(model).where(model.user_id == user_id)
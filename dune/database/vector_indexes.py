@@ -0,0 +1,189 @@
+"""
+Approximate nearest neighbour indexes on the PGVector embedding table.
+
+langchain_pg_embedding stores every collection in one untyped `vector` column,
+so each collection gets a partial index over the embedding cast to its
+dimensions. pgvector indexes at most 2000 dimensions of `vector`, so larger
+embeddings are indexed as `halfvec`. Queries must use the same expression
+and collection predicate for the planner to pick the index up.
+
+Every chunk carries the owning `user_id` in its metadata, searches filter on it
+through an expression index so a user's search only touches their own rows.
+"""
+
+import logging
+from enum import StrEnum
+from uuid import UUID
+
+from pydantic_settings import BaseSettings
+from sqlalchemy import Connection, Engine, text
+
+EMBEDDING_TABLE = "langchain_pg_embedding"
+COLLECTION_TABLE = "langchain_pg_collection"
+MAX_VECTOR_INDEX_DIMENSIONS = 2000
+USER_PREDICATE = "(cmetadata->>'user_id') = :user_id"
+TEXT_SEARCH_CONFIG = "english"  # must match the document_tsv generated column
+
+
+class IndexMethod(StrEnum):
+    """pgvector index access methods"""
+
+    HNSW = "hnsw"
+    IVFFLAT = "ivfflat"
+
+
+class DistanceMetric(StrEnum):
+    """Distance metrics, named after the pgvector operator classes"""
+
+    COSINE = "cosine"
+    L2 = "l2"
+    INNER_PRODUCT = "ip"
+
+
+OPERATORS = {
+    DistanceMetric.COSINE: "<=>",
+    DistanceMetric.L2: "<->",
+    DistanceMetric.INNER_PRODUCT: "<#>",
+}
+
+
+class VectorIndexSettings(BaseSettings):
+    """Vector index settings"""
+
+    vector_index_method: IndexMethod = IndexMethod.HNSW
+    vector_distance_metric: DistanceMetric = DistanceMetric.COSINE
+    hnsw_m: int = 16
+    hnsw_ef_construction: int = 64
+    hnsw_ef_search: int = 40  # candidate list size per query
+    hnsw_iterative_scan: str = "strict_order"  # keep scanning when filters drop rows
+    ivfflat_lists: int = 100
+    ivfflat_probes: int = 10  # lists searched per query
+
+
+def vector_type(dimensions: int) -> str:
+    """column type used to index embeddings of this size"""
+    return "halfvec" if dimensions > MAX_VECTOR_INDEX_DIMENSIONS else "vector"
+
+
+def embedding_expression(dimensions: int) -> str:
+    """embedding column cast to the indexed type"""
+    return f"(embedding::{vector_type(dimensions)}({dimensions}))"
+
+
+def distance_expression(dimensions: int, metric: DistanceMetric, param: str) -> str:
+    """distance between the indexed embedding and a bound query vector"""
+    type_ = f"{vector_type(dimensions)}({dimensions})"
+    operator = OPERATORS[metric]
+    return f"{embedding_expression(dimensions)} {operator} CAST(:{param} AS {type_})"
+
+
+def collection_predicate(collection_id: UUID) -> str:
+    """
+    partial index predicate, inlined rather than bound so the planner can
+    match it against the index
+    """
+    return f"collection_id = '{UUID(str(collection_id))}'"
+
+
+def index_name(collection: str, method: IndexMethod, metric: DistanceMetric) -> str:
+    """name of the index for a collection"""
+    return f"ix_{collection.replace('-', '_')}_{method}_{metric}"
+
+
+def search_settings_stmt(settings: VectorIndexSettings):
+    """set the query time accuracy knob of the configured index method"""
+    if settings.vector_index_method == IndexMethod.HNSW:
+        return text(
+            "SELECT set_config('hnsw.ef_search', :value, false),"
+            " set_config('hnsw.iterative_scan', :scan, false)"
+        ).bindparams(
+            value=str(settings.hnsw_ef_search), scan=settings.hnsw_iterative_scan
+        )
+    return text("SELECT set_config('ivfflat.probes', :value, false)").bindparams(
+        value=str(settings.ivfflat_probes)
+    )
+
+
+def ensure_collection(connection: Connection, name: str) -> UUID:
+    """return the uuid of a collection, creating it if needed"""
+    connection.execute(
+        text(
+            f"INSERT INTO {COLLECTION_TABLE} (uuid, name)"
+            " VALUES (gen_random_uuid(), :name) ON CONFLICT (name) DO NOTHING"
+        ),
+        {"name": name},
+    )
+    return connection.execute(
+        text(f"SELECT uuid FROM {COLLECTION_TABLE} WHERE name = :name"),
+        {"name": name},
+    ).scalar_one()
+
+
+def create_vector_index(
+    connection: Connection,
+    collection: str,
+    dimensions: int,
+    settings: VectorIndexSettings,
+    concurrently: bool = False,
+):
+    """
+    Create the configured index for a collection and drop indexes left over
+    from other methods or metrics.
+    """
+    method, metric = settings.vector_index_method, settings.vector_distance_metric
+    collection_id = ensure_collection(connection, collection)
+    name = index_name(collection, method, metric)
+    options = (
+        f"m = {settings.hnsw_m}, ef_construction = {settings.hnsw_ef_construction}"
+        if method == IndexMethod.HNSW
+        else f"lists = {settings.ivfflat_lists}"
+    )
+    keyword = "CONCURRENTLY " if concurrently else ""
+    logging.info("Creating %s index %s", method, name)
+    connection.execute(
+        text(
+            f"CREATE INDEX {keyword}IF NOT EXISTS {name} ON {EMBEDDING_TABLE}"
+            f" USING {method} ({embedding_expression(dimensions)}"
+            f" {vector_type(dimensions)}_{metric}_ops) WITH ({options})"
+            f" WHERE {collection_predicate(collection_id)}"
+        )
+    )
+    for other_method in IndexMethod:
+        for other_metric in DistanceMetric:
+            other = index_name(collection, other_method, other_metric)
+            if other != name:
+                connection.execute(text(f"DROP INDEX {keyword}IF EXISTS {other}"))
+
+
+def reindex_vector_index(
+    connection: Connection,
+    collection: str,
+    settings: VectorIndexSettings,
+    concurrently: bool = False,
+):
+    """rebuild a collection's index, e.g. after a large bulk load"""
+    name = index_name(
+        collection, settings.vector_index_method, settings.vector_distance_metric
+    )
+    keyword = "CONCURRENTLY " if concurrently else ""
+    logging.info("Rebuilding index %s", name)
+    connection.execute(text(f"REINDEX INDEX {keyword}{name}"))
+
+
+def manage_vector_indexes(
+    engine: Engine,
+    collections: dict[str, int],
+    settings: VectorIndexSettings,
+    reindex: bool = False,
+):
+    """
+    Create or rebuild the index of every collection without blocking writes.
+    `engine` must be in autocommit mode, concurrent index builds cannot run
+    inside a transaction.
+    """
+    with engine.connect() as connection:
+        for collection, dimensions in collections.items():
+            if reindex:
+                reindex_vector_index(connection, collection, settings, True)
+            else:
+                create_vector_index(connection, collection, dimensions, settings, True)
@@ -0,0 +1,302 @@
+"""
+Embedding wrappers shared by the vector stores
+"""
+
+from array import array
+import asyncio
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+import hashlib
+import logging
+import time
+
+from langchain_core.embeddings import Embeddings
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+
+def encode_vector(vector: list[float]) -> bytes:
+    """pack a vector as float32 bytes"""
+    return array("f", vector).tobytes()
+
+
+def decode_vector(data: bytes) -> list[float]:
+    """unpack a vector packed by `encode_vector`"""
+    return array("f", data).tolist()
+
+
+def normalize_query(text: str) -> str:
+    """collapse whitespace and case so trivially different queries share a key"""
+    return " ".join(text.split()).casefold()
+
+
+@dataclass
+class CacheStats:
+    """Query embedding cache counters"""
+
+    local_hits: int = 0
+    redis_hits: int = 0
+    misses: int = 0
+
+    def as_dict(self):
+        """counters with the overall hit rate"""
+        total = self.local_hits + self.redis_hits + self.misses
+        hits = self.local_hits + self.redis_hits
+        return {**asdict(self), "hit_rate": hits / total if total else 0.0}
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Content addressed embedding cache in front of another Embeddings object.
+
+    Vectors are stored in Redis under (provider, model, sha256(text)) with a
+    TTL that is refreshed on every hit, so rarely used entries expire first.
+    Query embeddings are keyed on the normalized query and also kept in an
+    in-process LRU of `query_cache_size` entries.
+    A Redis failure falls back to embedding everything.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        provider: str,
+        model: str,
+        redis_client: Redis,
+        ttl: int,
+        query_cache_size: int = 1024,
+        query_ttl: int = 60 * 60 * 24,
+    ):
+        self.embeddings = embeddings
+        self.provider = provider
+        self.model = model
+        self.redis_client = redis_client
+        self.ttl = ttl
+        self.query_cache_size = query_cache_size
+        self.query_ttl = query_ttl
+        self.query_stats = CacheStats()
+        self._queries: OrderedDict[str, list[float]] = OrderedDict()
+
+    def _key(self, text: str, namespace: str = "embedding") -> str:
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{namespace}:{self.provider}:{self.model}:{digest}"
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embeddings.embed_query(text)
+
+    async def _get_cached(self, texts: list[str]) -> list[list[float] | None]:
+        try:
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                for text in texts:
+                    pipe.getex(self._key(text), ex=self.ttl)
+                cached = await pipe.execute()
+        except RedisError:
+            logging.exception("Embedding cache lookup failed")
+            return [None] * len(texts)
+        return [decode_vector(data) if data else None for data in cached]
+
+    async def _set_cached(self, vectors: dict[str, list[float]]):
+        try:
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                for text, vector in vectors.items():
+                    pipe.set(self._key(text), encode_vector(vector), ex=self.ttl)
+                await pipe.execute()
+        except RedisError:
+            logging.exception("Embedding cache update failed")
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        vectors = await self._get_cached(texts)
+        missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+        logging.debug(
+            "Embedding cache %s/%s: %s hits",
+            self.provider,
+            self.model,
+            len(texts) - len(missing),
+        )
+        if not missing:
+            return vectors  # type: ignore[return-value]
+        embedded = dict(zip(missing, await self.embeddings.aembed_documents(missing)))
+        await self._set_cached(embedded)
+        return [
+            vector if vector is not None else embedded[text]
+            for text, vector in zip(texts, vectors)
+        ]
+
+    async def aembed_query(self, text: str) -> list[float]:
+        key = self._key(normalize_query(text), "query-embedding")
+        if (vector := self._queries.get(key)) is not None:
+            self._queries.move_to_end(key)
+            self.query_stats.local_hits += 1
+            return vector
+        try:
+            data = await self.redis_client.getex(key, ex=self.query_ttl)
+        except RedisError:
+            logging.exception("Query embedding cache lookup failed")
+            data = None
+        if data:
+            vector = decode_vector(data)
+            self.query_stats.redis_hits += 1
+        else:
+            vector = await self.embeddings.aembed_query(text)
+            self.query_stats.misses += 1
+            try:
+                await self.redis_client.set(
+                    key, encode_vector(vector), ex=self.query_ttl
+                )
+            except RedisError:
+                logging.exception("Query embedding cache update failed")
+        self._queries[key] = vector
+        if len(self._queries) > self.query_cache_size:
+            self._queries.popitem(last=False)
+        return vector
+
+
+def is_rate_limited(error: Exception) -> bool:
+    """whether a provider error is an HTTP 429"""
+    if getattr(error, "status_code", None) == 429:
+        return True
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None) == 429
+
+
+class BatchingEmbeddings(Embeddings):
+    """
+    Groups aembed_documents calls from concurrent documents into larger requests.
+
+    Texts are queued and a dispatcher packs them into batches of at most
+    `batch_size` texts and `max_batch_tokens` estimated tokens, keeping at most
+    `max_in_flight` requests running. The batch size grows while requests finish
+    under `target_latency` seconds and halves when they are slower or rate limited.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        *,
+        max_batch_tokens: int,
+        min_batch_size: int,
+        max_batch_size: int,
+        max_in_flight: int,
+        target_latency: float,
+        linger: float,
+        rate_limit_retries: int,
+    ):
+        self.embeddings = embeddings
+        self.max_batch_tokens = max_batch_tokens
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.target_latency = target_latency
+        self.linger = linger
+        self.rate_limit_retries = rate_limit_retries
+        self.batch_size = min_batch_size
+        self._max_in_flight = max_in_flight
+        self._queue: asyncio.Queue[tuple[str, asyncio.Future]] | None = None
+        self._slots: asyncio.Semaphore | None = None
+        self._dispatcher: asyncio.Task | None = None
+        self._running: set[asyncio.Task] = set()
+
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        """cheap token estimate, roughly four characters per token"""
+        return len(text) // 4 + 1
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embeddings.embed_query(text)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return await self.embeddings.aembed_query(text)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        if self._dispatcher is None or self._dispatcher.done():
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self._max_in_flight)
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        loop = asyncio.get_running_loop()
+        futures = []
+        for text in texts:
+            future = loop.create_future()
+            self._queue.put_nowait((text, future))  # type: ignore[union-attr]
+            futures.append(future)
+        return list(await asyncio.gather(*futures))
+
+    async def _next_batch(self, carry: tuple[str, asyncio.Future] | None):
+        """collect a batch, returning it and the item that did not fit"""
+        queue = self._queue
+        assert queue is not None
+        loop = asyncio.get_running_loop()
+        batch = [carry or await queue.get()]
+        tokens = self.estimate_tokens(batch[0][0])
+        deadline = loop.time() + self.linger
+        while len(batch) < self.batch_size:
+            if queue.empty():
+                try:
+                    item = await asyncio.wait_for(queue.get(), deadline - loop.time())
+                except TimeoutError:
+                    break
+            else:
+                item = queue.get_nowait()
+            item_tokens = self.estimate_tokens(item[0])
+            if tokens + item_tokens > self.max_batch_tokens:
+                return batch, item
+            batch.append(item)
+            tokens += item_tokens
+        return batch, None
+
+    async def _dispatch(self):
+        assert self._slots is not None
+        carry = None
+        while True:
+            batch, carry = await self._next_batch(carry)
+            await self._slots.acquire()
+            task = asyncio.create_task(self._run(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: list[tuple[str, asyncio.Future]]):
+        assert self._slots is not None
+        texts = [text for text, _ in batch]
+        try:
+            for attempt in range(self.rate_limit_retries + 1):
+                started = time.monotonic()
+                try:
+                    vectors = await self.embeddings.aembed_documents(texts)
+                except Exception as e:  # pylint: disable=broad-except
+                    if not is_rate_limited(e) or attempt == self.rate_limit_retries:
+                        raise
+                    self._shrink()
+                    await asyncio.sleep(2**attempt)
+                    continue
+                self._adapt(time.monotonic() - started)
+                break
+            if len(vectors) != len(batch):
+                raise ValueError(
+                    f"Expected {len(batch)} embeddings, got {len(vectors)}"
+                )
+        except Exception as e:  # pylint: disable=broad-except
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future), vector in zip(batch, vectors):
+                if not future.done():
+                    future.set_result(vector)
+        finally:
+            self._slots.release()
+
+    def _shrink(self):
+        self.batch_size = max(self.min_batch_size, self.batch_size // 2)
+        logging.info("Embedding batch size reduced to %s", self.batch_size)
+
+    def _adapt(self, latency: float):
+        if latency > self.target_latency:
+            self._shrink()
+        elif self.batch_size < self.max_batch_size:
+            self.batch_size = min(self.max_batch_size, self.batch_size * 2)
+            logging.debug("Embedding batch size increased to %s", self.batch_size)
@@ -13,14 +13,16 @@ from .settings import (
     get_google_client,
     get_drive_fetch_settings,
 )
-from .helpers import check_file_exists, post_file
+from .helpers import find_existing_files, post_file
+
+
+def drive_external_id(file_id: str) -> str:
+    """external id a drive file is stored under"""
+    return f"drive:{file_id}"
 
 
 async def download_drive_file(service: Resource, file_id: str, filename: str):
     """Download a Google Drive file and post it to the document endpoint."""
-    if await check_file_exists(filename, get_drive_fetch_settings().api_uri):
-        logging.info("Skipping already existing drive file: %s", filename)
-        return
 
     def download_file_sync() -> bytes:
         request = service.files().get_media(fileId=file_id)
@@ -44,7 +46,12 @@ async def download_drive_file(service: Resource, file_id: str, filename: str):
         return
 
     try:
-        await post_file(filename, data, get_drive_fetch_settings().api_uri)
+        await post_file(
+            filename,
+            data,
+            get_drive_fetch_settings().api_uri,
+            external_id=drive_external_id(file_id),
+        )
         logging.info("Drive file saved: %s", filename)
     except Exception as e:
         logging.error("Unable to post drive file %s: %s", filename, e)
@@ -117,6 +124,7 @@ async def enumerate_drive_files():
             break
 
         files = result.get("files", [])
+        candidates = []
         for f in files:
             file_id = f.get("id")
             file_name = f.get("name")
@@ -131,11 +139,29 @@ async def enumerate_drive_files():
                 )
                 continue
             if file_id:
-                tasks.append(
-                    asyncio.create_task(
-                        process_drive_file_with_semaphore(file_id, semaphore)
-                    )
+                candidates.append((file_id, file_name))
+
+        try:
+            existing = await find_existing_files(
+                drive_settings.api_uri,
+                filenames=[name for _, name in candidates],
+                external_ids=[drive_external_id(id_) for id_, _ in candidates],
+            )
+        except Exception as e:
+            logging.error("Unable to check existing drive files: %s", e)
+            break
+        existing_ids = set(existing["external_ids"])
+        # files synced before external ids were stored only match by name
+        unlinked = set(existing["unlinked_filenames"])
+        for file_id, file_name in candidates:
+            if drive_external_id(file_id) in existing_ids or file_name in unlinked:
+                logging.info("Skipping already existing drive file: %s", file_name)
+                continue
+            tasks.append(
+                asyncio.create_task(
+                    process_drive_file_with_semaphore(file_id, semaphore)
                 )
+            )
 
         page_token = result.get("nextPageToken")
         if not page_token:
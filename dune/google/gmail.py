@@ -9,17 +9,23 @@ import logging
 from googleapiclient.discovery import build, Resource
 
 from .settings import get_google_client, get_gmail_fetch_settings
-from .helpers import check_file_exists, post_file
+from .helpers import find_existing_files, post_file
+
+
+def gmail_external_id(message_id: str, part_id: str) -> str:
+    """external id an attachment is stored under, attachment ids are not stable"""
+    return f"gmail:{message_id}:{part_id}"
 
 
 async def download_attachment(
-    service: Resource, user_id: str, message_id: str, attachment_id: str, filename: str
+    service: Resource,
+    user_id: str,
+    message_id: str,
+    attachment_id: str,
+    filename: str,
+    external_id: str | None = None,
 ):
     """Download attachment"""
-    if await check_file_exists(filename, get_gmail_fetch_settings().api_uri):
-        logging.info("Skipping already existing attachment: %s", filename)
-        return
-
     try:
         attachment = (
             service.users()
@@ -48,14 +54,14 @@ async def download_attachment(
         )
         return
 
-    await post_file(filename, data, get_gmail_fetch_settings().api_uri)
+    await post_file(
+        filename, data, get_gmail_fetch_settings().api_uri, external_id=external_id
+    )
     logging.info("Attachment saved: %s", filename)
 
 
-async def process_email(
-    service: Resource, user_id: str, msg: dict, attachments_list: list[dict]
-):
-    """Process email"""
+async def process_email(service: Resource, user_id: str, msg: dict) -> list[dict]:
+    """Fetch an email and list its attachments"""
     email_id = msg["id"]
     try:
         email = (
@@ -66,8 +72,9 @@ async def process_email(
         )
     except Exception as e:
         logging.exception("Unable to retrieve email %s: %s", email_id, e)
-        return 0
+        return []
 
+    attachments = []
     parts = email.get("payload", {}).get("parts", [])
     for part in parts:
         filename = part.get("filename", "")
@@ -80,29 +87,76 @@ async def process_email(
                     "Skipping attachment %s due to excluded extension.", filename
                 )
                 continue
-            await download_attachment(
-                service, user_id, email_id, attachment_id, filename
-            )
-            attachments_list.append(
+            attachments.append(
                 {
                     "email_id": email_id,
                     "attachment_id": attachment_id,
                     "filename": filename,
+                    "external_id": gmail_external_id(
+                        email_id, part.get("partId") or filename
+                    ),
                 }
             )
-    return 1
+    return attachments
 
 
-async def process_email_with_semaphore(
+async def process_page(
     service: Resource,
     user_id: str,
-    msg: dict,
-    attachments_list: list[dict],
+    messages: list[dict],
     semaphore: asyncio.Semaphore,
-):
-    """Process an email while respecting concurrency limits."""
-    async with semaphore:
-        await process_email(service, user_id, msg, attachments_list)
+) -> list[dict]:
+    """
+    Fetch a page of emails, check all of their attachments against the system
+    in one request and download the missing ones. Attachments are matched by
+    message and part, so attachments sharing a name are all kept, and content
+    already stored under another name is recorded as a duplicate by the API.
+    """
+
+    async def with_semaphore(coro):
+        async with semaphore:
+            return await coro
+
+    pages = await asyncio.gather(
+        *(with_semaphore(process_email(service, user_id, msg)) for msg in messages)
+    )
+    attachments = [attachment for page in pages for attachment in page]
+    if not attachments:
+        return []
+    try:
+        existing = await find_existing_files(
+            get_gmail_fetch_settings().api_uri,
+            filenames=[attachment["filename"] for attachment in attachments],
+            external_ids=[attachment["external_id"] for attachment in attachments],
+        )
+    except Exception as e:
+        logging.error("Unable to check existing attachments: %s", e)
+        return []
+    seen = set(existing["external_ids"])
+    # attachments synced before external ids were stored only match by name
+    unlinked = set(existing["unlinked_filenames"])
+    downloads = []
+    for attachment in attachments:
+        if attachment["external_id"] in seen or attachment["filename"] in unlinked:
+            logging.info(
+                "Skipping already existing attachment: %s", attachment["filename"]
+            )
+            continue
+        seen.add(attachment["external_id"])
+        downloads.append(
+            with_semaphore(
+                download_attachment(
+                    service,
+                    user_id,
+                    attachment["email_id"],
+                    attachment["attachment_id"],
+                    attachment["filename"],
+                    attachment["external_id"],
+                )
+            )
+        )
+    await asyncio.gather(*downloads)
+    return attachments
 
 
 async def fetch_emails():
@@ -140,16 +194,9 @@ async def fetch_emails():
             logging.info("No messages found.")
             break
 
-        # Wrap each email processing call in a semaphore-controlled task.
-        tasks = [
-            asyncio.create_task(
-                process_email_with_semaphore(
-                    service, user_id, msg, all_attachments, semaphore
-                )
-            )
-            for msg in messages
-        ]
-        await asyncio.gather(*tasks)
+        all_attachments.extend(
+            await process_page(service, user_id, messages, semaphore)
+        )
 
         email_count += len(messages)
         if (
@@ -5,19 +5,26 @@ Helper functions
 import httpx
 
 
-async def check_file_exists(filename: str, api_url: str):
-    """check file exists in system"""
+async def find_existing_files(
+    api_url: str,
+    filenames: list[str] | None = None,
+    external_ids: list[str] | None = None,
+):
+    """check which of many files exist in system, in one request"""
     async with httpx.AsyncClient(
         transport=httpx.AsyncHTTPTransport(retries=3), timeout=10
     ) as c:
-        resp = await c.get(
-            f"{api_url}/documents/document",
-            params={"filename": filename},
+        resp = await c.post(
+            f"{api_url}/documents/exists",
+            json={"filenames": filenames or [], "external_ids": external_ids or []},
         )
+        resp.raise_for_status()
         return resp.json()
 
 
-async def post_file(filename: str, data: bytes, api_url: str):
+async def post_file(
+    filename: str, data: bytes, api_url: str, external_id: str | None = None
+):
     """check file exists in system"""
     async with httpx.AsyncClient(
         transport=httpx.AsyncHTTPTransport(retries=3), timeout=10
@@ -25,5 +32,6 @@ async def post_file(filename: str, data: bytes, api_url: str):
         resp = await c.post(
             f"{api_url}/documents/document",
             files={"file": (filename, data)},
+            data={"external_id": external_id} if external_id else None,
         )
         return resp.json()
@@ -31,6 +31,7 @@ class OaiSettings(BaseSettings):
     openai_api_key: str = ""
     openai_model: OaiModel = OaiModel.GPT4
     openai_embedding_model: OaiEmbeddingModel = OaiEmbeddingModel.TEXT_EMBEDDING_3_LARGE
+    openai_embedding_dimensions: int = 3072
 
 
 @lru_cache
@@ -0,0 +1,138 @@
+"""
+Windowed chat history.
+
+Only the last `history_max_messages` messages of a session are loaded, with
+an indexed LIMIT query, and the oldest of them are dropped until the window
+fits `history_token_budget`. When summaries are enabled, messages that fall
+out of the window are folded into a rolling per-session summary which is
+sent ahead of the window and counted against the same budget, so the per
+turn cost stays flat for long sessions.
+"""
+
+import logging
+from typing import List
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import (
+    BaseMessage,
+    HumanMessage,
+    SystemMessage,
+    get_buffer_string,
+    messages_from_dict,
+)
+from sqlalchemy import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .chunking import count_tokens
+from .database.chat_history_wrapper import SQLAlchemyChatMessageHistory
+from .database.models import ChatMessageModel, ChatSummaryModel
+from .settings import async_session_context, get_settings
+
+SUMMARY_PROMPT = (
+    "Progressively summarize the conversation below, extending the existing"
+    " summary with the new lines. Keep names, facts and decisions, drop"
+    " pleasantries. Reply with the summary only."
+)
+
+
+def message_tokens(message: BaseMessage) -> int:
+    """tokens of a message's text"""
+    return count_tokens(str(message.content))
+
+
+def trim_to_budget(messages: list[BaseMessage], budget: int) -> list[BaseMessage]:
+    """keep the newest messages that fit in `budget` tokens"""
+    kept, tokens = [], 0
+    for message in reversed(messages):
+        tokens += message_tokens(message)
+        if tokens > budget:
+            break
+        kept.append(message)
+    return kept[::-1]
+
+
+def summary_message(summary: ChatSummaryModel) -> SystemMessage:
+    """the session summary as sent ahead of the window"""
+    return SystemMessage(f"Summary of the earlier conversation: {summary.summary}")
+
+
+async def load_window(
+    session: AsyncSession, session_id: int
+) -> tuple[list[Row], ChatSummaryModel | None]:
+    """
+    Rows of the history window, oldest first, and the session summary.
+    The window is the last `history_max_messages` messages, trimmed to the
+    token budget left once the summary is accounted for.
+    """
+    settings = get_settings().history_settings
+    summary = None
+    budget = settings.history_token_budget
+    if settings.history_summaries:
+        summary = await session.scalar(ChatSummaryModel.get_summary_stmt(session_id))
+        if summary is not None:
+            budget -= message_tokens(summary_message(summary))
+    result = await session.execute(
+        ChatMessageModel.recent_messages_stmt(session_id, settings.history_max_messages)
+    )
+    rows = result.all()[::-1]
+    kept = trim_to_budget(messages_from_dict([row.message for row in rows]), budget)
+    return rows[len(rows) - len(kept) :], summary
+
+
+class WindowedChatMessageHistory(SQLAlchemyChatMessageHistory):
+    """chat history that only reads the recent window and the session summary"""
+
+    async def aget_messages(self) -> List[BaseMessage]:
+        rows, summary = await load_window(
+            self._get_async_session(), self.chat_session_id
+        )
+        messages = messages_from_dict([row.message for row in rows])
+        if summary is not None:
+            messages.insert(0, summary_message(summary))
+        return messages
+
+
+async def update_summary(session_id: int, client: BaseChatModel):
+    """
+    Fold messages that fell out of the history window into the session summary
+    once at least `history_summary_batch` of them have accumulated. The window
+    starts where `load_window` trims it, so every message is either in the
+    window or, once enough have piled up, in the summary.
+    Meant to run after the response has been sent.
+    """
+    settings = get_settings().history_settings
+    if not settings.history_summaries:
+        return
+    try:
+        async with async_session_context() as session:
+            window, summary = await load_window(session, session_id)
+            result = await session.execute(
+                ChatMessageModel.messages_between_stmt(
+                    session_id,
+                    summary.last_message_id if summary else 0,
+                    window[0].id if window else None,
+                    settings.history_summary_max_messages,
+                )
+            )
+            rows = result.all()
+            if len(rows) < settings.history_summary_batch:
+                return
+            transcript = get_buffer_string(
+                messages_from_dict([row.message for row in rows])
+            )
+            response = await client.ainvoke(
+                [
+                    SystemMessage(SUMMARY_PROMPT),
+                    HumanMessage(
+                        f"Current summary:\n{summary.summary if summary else ''}"
+                        f"\n\nNew lines:\n{transcript}"
+                    ),
+                ]
+            )
+            await session.execute(
+                ChatSummaryModel.upsert_summary_stmt(
+                    session_id, str(response.content), rows[-1].id
+                )
+            )
+    except Exception:  # pylint: disable=broad-except
+        logging.exception("Failed to update the summary of session %s", session_id)
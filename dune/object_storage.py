@@ -0,0 +1,149 @@
+"""
+Streaming uploads to and downloads from object storage.
+
+Bodies are cut into parts as they arrive and each part is sent with
+`upload_part` while the next one is being read, at most
+`os_upload_concurrency` parts at a time, so memory use is bounded by
+part size times concurrency whatever the file size. The sha256 of the
+content is computed on the way through.
+"""
+
+import asyncio
+from dataclasses import dataclass
+import hashlib
+import logging
+from typing import TYPE_CHECKING, AsyncIterator, Awaitable, Callable
+
+from fastapi import UploadFile
+
+from .settings import get_settings
+
+if TYPE_CHECKING:
+    from types_aiobotocore_s3 import S3Client
+
+MIN_PART_SIZE = 5 * 1024 * 1024  # S3 minimum for every part but the last
+
+
+@dataclass
+class UploadResult:
+    """object written by `upload_stream`"""
+
+    key: str
+    size: int
+    sha256: str
+    stored: bool = True  # false when `keep` turned the object down
+
+
+async def read_upload_file(file: UploadFile, chunk_size: int) -> AsyncIterator[bytes]:
+    """read a starlette upload in chunks"""
+    while chunk := await file.read(chunk_size):
+        yield chunk
+
+
+async def hash_upload_file(file: UploadFile, chunk_size: int) -> str:
+    """sha256 of an upload, leaving it rewound"""
+    digest = hashlib.sha256()
+    while chunk := await file.read(chunk_size):
+        digest.update(chunk)
+    await file.seek(0)
+    return digest.hexdigest()
+
+
+async def iter_body(body, chunk_size: int) -> AsyncIterator[bytes]:
+    """stream a get_object body in chunks, releasing the connection at the end"""
+    try:
+        async for chunk in body.iter_chunks(chunk_size):
+            yield chunk
+    finally:
+        body.close()
+
+
+async def upload_stream(
+    client: "S3Client",
+    key: str,
+    chunks: AsyncIterator[bytes],
+    content_type: str | None = None,
+    keep: Callable[[str], Awaitable[bool]] | None = None,
+) -> UploadResult:
+    """
+    Upload a stream of bytes to the bucket. Bodies smaller than one part are
+    sent with a single put_object, larger ones with a multipart upload that is
+    aborted if anything fails.
+    Once the whole body has been read, `keep` is called with its sha256 and
+    the upload is abandoned if it returns False.
+    """
+    settings = get_settings().os_settings
+    part_size = max(settings.os_part_size, MIN_PART_SIZE)
+    extra = {"ContentType": content_type} if content_type else {}
+    digest = hashlib.sha256()
+    buffer = bytearray()
+    size = 0
+    upload_id: str | None = None
+    slots = asyncio.Semaphore(settings.os_upload_concurrency)
+    tasks: list[asyncio.Task] = []
+
+    async def send_part(upload_id: str, number: int, body: bytes):
+        try:
+            response = await client.upload_part(
+                Bucket=settings.os_bucket,
+                Key=key,
+                UploadId=upload_id,
+                PartNumber=number,
+                Body=body,
+            )
+            return {"PartNumber": number, "ETag": response["ETag"]}
+        finally:
+            slots.release()
+
+    async def start_part(body: bytes):
+        nonlocal upload_id
+        if upload_id is None:
+            response = await client.create_multipart_upload(
+                Bucket=settings.os_bucket, Key=key, **extra
+            )
+            upload_id = response["UploadId"]
+        await slots.acquire()
+        tasks.append(asyncio.create_task(send_part(upload_id, len(tasks) + 1, body)))
+
+    async def abort():
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if upload_id is not None:
+            logging.info("Aborting multipart upload of %s", key)
+            await asyncio.shield(
+                client.abort_multipart_upload(
+                    Bucket=settings.os_bucket, Key=key, UploadId=upload_id
+                )
+            )
+
+    try:
+        async for chunk in chunks:
+            digest.update(chunk)
+            size += len(chunk)
+            buffer += chunk
+            while len(buffer) >= part_size:
+                await start_part(bytes(buffer[:part_size]))
+                del buffer[:part_size]
+        sha256 = digest.hexdigest()
+        if keep is not None and not await keep(sha256):
+            await abort()
+            return UploadResult(key, size, sha256, stored=False)
+        if upload_id is None:
+            await client.put_object(
+                Bucket=settings.os_bucket, Key=key, Body=bytes(buffer), **extra
+            )
+            return UploadResult(key, size, sha256)
+        if buffer:
+            await start_part(bytes(buffer))
+        parts = await asyncio.gather(*tasks)
+        await client.complete_multipart_upload(
+            Bucket=settings.os_bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts},
+        )
+    except BaseException:
+        await abort()
+        raise
+    return UploadResult(key, size, sha256)
@@ -36,6 +36,7 @@ class OllamaSettings(BaseSettings):
     ollama_embeddings_model: OllamaEmbeddingModel = (
         OllamaEmbeddingModel.NOMIC_EMBED_MODEL
     )
+    ollama_embeddings_dimensions: int = 768
     ollama_url: str = "http://localhost:11434"
 
 
@@ -0,0 +1,156 @@
+"""
+Document parsing and chunking in a process pool.
+
+unstructured/rapidocr parsing is CPU bound, so files are downloaded and parsed
+in worker processes and the event loop only waits on the result.
+"""
+
+import asyncio
+import importlib
+import logging
+import multiprocessing
+import os
+import resource
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from langchain_core.documents import Document
+
+from .chunking import chunk_documents
+from .settings import get_settings, get_sync_os_client
+
+_EXECUTOR: ProcessPoolExecutor | None = None
+_RESTART_LOCK = asyncio.Lock()
+
+
+def _init_parser_process(memory_limit_mb: int):
+    """cap the process memory and import the parsers before the first file"""
+    if memory_limit_mb > 0:
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    importlib.import_module("unstructured.partition.auto")
+
+
+def _warm_up() -> int:
+    """no-op task used to start pool processes ahead of time"""
+    return os.getpid()
+
+
+def _load(path: str) -> list[Document]:
+    """
+    download and parse a file with the process' long lived client, as a
+    single document like S3FileLoader does
+    """
+    from unstructured.partition.auto import (  # pylint: disable=import-outside-toplevel
+        partition,
+    )
+
+    bucket = get_settings().os_settings.os_bucket
+    with tempfile.TemporaryDirectory() as temp_dir:
+        file_path = os.path.join(temp_dir, os.path.basename(path))
+        get_sync_os_client().download_file(bucket, path, file_path)
+        elements = partition(filename=file_path)
+    return [
+        Document(
+            page_content="\n\n".join(str(element) for element in elements),
+            metadata={"source": f"s3://{bucket}/{path}"},
+        )
+    ]
+
+
+def _parse(path: str) -> list[Document]:
+    """download, parse and chunk a file, runs inside a pool process"""
+    return chunk_documents(_load(path))
+
+
+def get_parser_pool():
+    """return the parser process pool, creating it if needed"""
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        settings = get_settings().parser_settings
+        _EXECUTOR = ProcessPoolExecutor(
+            max_workers=settings.parser_processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_parser_process,
+            initargs=(settings.parser_memory_limit_mb,),
+            max_tasks_per_child=settings.parser_max_tasks_per_child,
+        )
+    return _EXECUTOR
+
+
+async def start_parser_pool():
+    """start every pool process so the first documents do not pay for it"""
+    executor = get_parser_pool()
+    loop = asyncio.get_running_loop()
+    pids = await asyncio.gather(
+        *(
+            loop.run_in_executor(executor, _warm_up)
+            for _ in range(get_settings().parser_settings.parser_processes)
+        )
+    )
+    logging.info("Started %s parser processes", len(set(pids)))
+
+
+def shutdown_parser_pool(kill: bool = False):
+    """
+    Stop the parser pool.
+    A parse that is already running cannot be cancelled, so `kill` terminates
+    the processes instead of waiting for them. `_processes` is None once the
+    pool has broken, in which case the executor already terminated them.
+    """
+    global _EXECUTOR
+    executor, _EXECUTOR = _EXECUTOR, None
+    if executor is None:
+        return
+    if kill:
+        processes = executor._processes or {}  # pylint: disable=protected-access
+        for process in list(processes.values()):
+            process.terminate()
+    executor.shutdown(wait=not kill, cancel_futures=True)
+
+
+async def restart_parser_pool(executor: ProcessPoolExecutor):
+    """
+    Replace a broken or stuck pool with a new warmed up one. Callers that saw
+    the same pool fail share a single restart.
+    """
+    async with _RESTART_LOCK:
+        if _EXECUTOR is not executor:
+            return
+        shutdown_parser_pool(kill=True)
+        await start_parser_pool()
+
+
+async def _submit(path: str) -> list[Document]:
+    """parse a file in the pool, restarting the pool if it hangs or breaks"""
+    executor = get_parser_pool()
+    loop = asyncio.get_running_loop()
+    try:
+        return await asyncio.wait_for(
+            loop.run_in_executor(executor, _parse, path),
+            get_settings().parser_settings.parser_timeout,
+        )
+    except TimeoutError:
+        logging.error("Parsing %s timed out, restarting parser pool", path)
+        await restart_parser_pool(executor)
+        raise
+    except BrokenProcessPool:
+        await restart_parser_pool(executor)
+        raise
+
+
+async def parse_document(path: str) -> list[Document]:
+    """
+    Parse and chunk a file in the process pool.
+    If the file takes longer than `parser_timeout` the pool is restarted.
+    A ProcessPoolExecutor fails every pending parse as soon as one of its
+    processes dies, so the timed out process cannot be killed on its own;
+    parses that were lost with the pool, or to a crashed process, are
+    retried once on the new pool instead.
+    """
+    try:
+        return await _submit(path)
+    except BrokenProcessPool:
+        logging.warning("Parser pool broke while parsing %s, retrying", path)
+        return await _submit(path)
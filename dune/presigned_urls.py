@@ -0,0 +1,109 @@
+"""
+Cache of presigned download URLs.
+
+A signed URL stays valid for `os_presigned_url_ttl` seconds, so it is kept in
+process and in Redis under (user, document id) and handed out again until
+`os_presigned_url_margin` seconds before it expires. Object keys embed the
+document id and never change for a document, so the id also pins the object
+version. Entries are dropped when the document is deleted.
+"""
+
+from collections import OrderedDict
+import logging
+import time
+from typing import TYPE_CHECKING, Awaitable, Callable, cast
+from uuid import UUID
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from .settings import get_settings
+
+if TYPE_CHECKING:
+    from types_aiobotocore_s3 import S3Client
+
+_URLS: OrderedDict[str, tuple[float, str, str]] = OrderedDict()
+
+
+def _key(user_id: UUID, id_: UUID) -> str:
+    return f"presigned-url:{user_id}:{id_}"
+
+
+def _remember(key: str, entry: tuple[float, str, str]):
+    _URLS[key] = entry
+    _URLS.move_to_end(key)
+    if len(_URLS) > get_settings().os_settings.os_presigned_url_cache_size:
+        _URLS.popitem(last=False)
+
+
+async def get_presigned_url(
+    client: "S3Client",
+    redis_client: Redis,
+    user_id: UUID,
+    id_: UUID,
+    get_path: Callable[[], Awaitable[str | None]],
+) -> str | None:
+    """
+    return a cached URL that is not about to expire, or look the object key up
+    with `get_path` and sign a new one. None when the document does not exist.
+    """
+    settings = get_settings().os_settings
+    key = _key(user_id, id_)
+    now = time.time()
+    entry = _URLS.get(key)
+    if entry is not None and entry[0] - settings.os_presigned_url_margin > now:
+        _URLS.move_to_end(key)
+        return entry[2]
+    try:
+        cached = await cast(
+            Awaitable[list[bytes | None]],
+            redis_client.hmget(key, ["expires_at", "path", "url"]),
+        )
+    except RedisError:
+        logging.exception("Presigned url cache lookup failed")
+        cached = [None, None, None]
+    expires_at, cached_path, cached_url = (
+        value.decode() if value is not None else None for value in cached
+    )
+    if (
+        expires_at
+        and cached_path
+        and cached_url
+        and float(expires_at) - settings.os_presigned_url_margin > now
+    ):
+        entry = (float(expires_at), cached_path, cached_url)
+        _remember(key, entry)
+        return entry[2]
+
+    if (path := await get_path()) is None:
+        return None
+    url = await client.generate_presigned_url(
+        "get_object",
+        Params={"Bucket": settings.os_bucket, "Key": path},
+        ExpiresIn=settings.os_presigned_url_ttl,
+    )
+    entry = (now + settings.os_presigned_url_ttl, path, url)
+    _remember(key, entry)
+    try:
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping={"expires_at": entry[0], "path": path, "url": url})
+            pipe.expire(
+                key, settings.os_presigned_url_ttl - settings.os_presigned_url_margin
+            )
+            await pipe.execute()
+    except RedisError:
+        logging.exception("Presigned url cache update failed")
+    return url
+
+
+async def invalidate_presigned_url(redis_client: Redis, user_id: UUID, id_: UUID):
+    """
+    drop the cached URL of a document. Other API processes keep their local
+    copy until it expires, which is harmless once the object is gone.
+    """
+    key = _key(user_id, id_)
+    _URLS.pop(key, None)
+    try:
+        await redis_client.delete(key)
+    except RedisError:
+        logging.exception("Presigned url cache invalidation failed for %s", id_)
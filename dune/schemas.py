@@ -13,22 +13,30 @@ class DbActions(StrEnum):
 
     UPGRADE = "upgrade"
     DOWNGRADE = "downgrade"
+    INDEX = "index"
+    REINDEX = "reindex"
 
 
-class RedisMessageType(StrEnum):
-    """Redis message type"""
+class Provider(StrEnum):
+    """Provider options"""
 
-    SUBSCRIBE = "subscribe"
-    MESSAGE = "message"
+    OPENAI = "openai"
+    OLLAMA = "ollama"
 
 
-class RedisMessage(BaseModel):
-    """
-    Redis message schema
-    """
+class RetrievalMode(StrEnum):
+    """How chat context is retrieved"""
+
+    VECTOR = "vector"
+    TEXT = "text"
+    HYBRID = "hybrid"
+
+
+class EmbeddingStatus(StrEnum):
+    """Outcome of embedding a document with a provider"""
 
-    data: bytes | int
-    type: RedisMessageType
+    SUCCESS = "success"
+    FAILED = "failed"
 
 
 class DocMetadataPayload(BaseModel):
@@ -37,5 +45,6 @@ class DocMetadataPayload(BaseModel):
     """
 
     id_: UUID
+    user_id: UUID
     path: str
     type_: str
@@ -0,0 +1,138 @@
+"""
+Semantic cache of chat answers.
+
+Answers are grouped by user, provider, chat model, the exact set of retrieved
+chunks and the conversation history sent with the question. Within a group a
+cached answer is replayed when the new question's embedding is close enough
+to the cached question's. Each group is indexed by the
+documents its chunks came from, so deleting or re-ingesting a document drops
+every answer that was built on it.
+"""
+
+import hashlib
+import logging
+import math
+import operator
+from typing import Awaitable, cast
+import uuid
+
+from langchain_core.documents import Document
+from langchain_core.messages import BaseMessage
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from .embeddings import decode_vector, encode_vector
+from .settings import get_settings
+
+
+def _normalize(vector: list[float]) -> list[float]:
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+
+def _context_key(
+    user_id: uuid.UUID,
+    provider: str,
+    model: str,
+    docs: list[Document],
+    history: list[BaseMessage],
+) -> str:
+    digest = hashlib.sha256()
+    for doc_id in sorted(str(doc.id) for doc in docs):
+        digest.update(f"{doc_id}\n".encode())
+    for message in history:
+        digest.update(f"\0{message.type}:{message.content}".encode())
+    return f"semantic-cache:{user_id}:{provider}:{model}:{digest.hexdigest()}"
+
+
+def _document_key(document_id: str) -> str:
+    return f"semantic-cache:document:{document_id}"
+
+
+def _document_ids(docs: list[Document]) -> set[str]:
+    return {
+        str(doc.metadata["document_id"])
+        for doc in docs
+        if doc.metadata.get("document_id")
+    }
+
+
+async def lookup_answer(
+    redis_client: Redis,
+    user_id: uuid.UUID,
+    provider: str,
+    model: str,
+    docs: list[Document],
+    history: list[BaseMessage],
+    embedding: list[float],
+) -> str | None:
+    """return the cached answer of the most similar question above the threshold"""
+    settings = get_settings().semantic_cache_settings
+    try:
+        raw = await cast(
+            Awaitable[dict[bytes, bytes]],
+            redis_client.hgetall(_context_key(user_id, provider, model, docs, history)),
+        )
+    except RedisError:
+        logging.exception("Semantic cache lookup failed")
+        return None
+    entries = {field.decode(): value for field, value in raw.items()}
+    query = _normalize(embedding)
+    best, best_score = None, settings.semantic_cache_threshold
+    for field, value in entries.items():
+        if not field.endswith(":embedding"):
+            continue
+        score = sum(map(operator.mul, query, decode_vector(value)))
+        if score >= best_score:
+            best, best_score = field.removesuffix(":embedding"), score
+    if best is None:
+        return None
+    answer = entries.get(f"{best}:answer")
+    logging.info("Semantic cache hit with similarity %.3f", best_score)
+    return answer.decode("utf-8") if answer is not None else None
+
+
+async def store_answer(
+    redis_client: Redis,
+    user_id: uuid.UUID,
+    provider: str,
+    model: str,
+    docs: list[Document],
+    history: list[BaseMessage],
+    embedding: list[float],
+    answer: str,
+):
+    """cache an answer and index it by the documents it was built from"""
+    settings = get_settings().semantic_cache_settings
+    key = _context_key(user_id, provider, model, docs, history)
+    entry = uuid.uuid4().hex
+    try:
+        # every entry is an embedding field and an answer field
+        size = await cast(Awaitable[int], redis_client.hlen(key))
+        if size >= 2 * settings.semantic_cache_max_entries:
+            return
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.hset(
+                key,
+                mapping={
+                    f"{entry}:embedding": encode_vector(_normalize(embedding)),
+                    f"{entry}:answer": answer,
+                },
+            )
+            pipe.expire(key, settings.semantic_cache_ttl)
+            for document_id in _document_ids(docs):
+                pipe.sadd(_document_key(document_id), key)
+                pipe.expire(_document_key(document_id), settings.semantic_cache_ttl)
+            await pipe.execute()
+    except RedisError:
+        logging.exception("Semantic cache update failed")
+
+
+async def invalidate_document(redis_client: Redis, document_id: str):
+    """drop every cached answer built on a document"""
+    document_key = _document_key(document_id)
+    try:
+        keys = await cast(Awaitable[set[bytes]], redis_client.smembers(document_key))
+        await redis_client.delete(document_key, *keys)
+    except RedisError:
+        logging.exception("Semantic cache invalidation failed for %s", document_id)
@@ -6,15 +6,20 @@ from contextlib import asynccontextmanager
 import logging
 import os
 import pathlib
+import socket
 import sys
 from functools import lru_cache
+from typing import TYPE_CHECKING
 import aioboto3
+import boto3
+from aiobotocore.config import AioConfig
+from botocore.config import Config
 from pydantic_settings import BaseSettings
 from redis.asyncio import Redis
+from langchain_core.embeddings import Embeddings
 from langchain_openai import OpenAIEmbeddings
 from langchain_postgres import PGVector
 from langchain_ollama import OllamaEmbeddings
-from langchain_community.document_loaders import S3FileLoader
 
 
 from botocore.exceptions import ClientError
@@ -23,16 +28,65 @@ from .database.config import (
     get_async_sessionmaker,
     get_sync_sessionmaker,
 )
+from .database.vector_indexes import VectorIndexSettings
+from .embeddings import BatchingEmbeddings, CachedEmbeddings
 from .ollama.settings import get_ollama_settings
 from .gpt.settings import get_oai_settings
+from .schemas import Provider
+
+if TYPE_CHECKING:
+    from types_aiobotocore_s3 import S3Client
+
+
+def wrap_embeddings(embeddings: Embeddings, provider: Provider, model: str):
+    """
+    put the request batcher and, when enabled, the content hash cache
+    in front of a provider's embeddings
+    """
+    batch_settings = get_settings().embedding_batch_settings
+    embeddings = BatchingEmbeddings(
+        embeddings,
+        max_batch_tokens=batch_settings.embedding_batch_max_tokens,
+        min_batch_size=batch_settings.embedding_batch_min_size,
+        max_batch_size=batch_settings.embedding_batch_max_size,
+        max_in_flight=batch_settings.embedding_batch_in_flight,
+        target_latency=batch_settings.embedding_batch_target_latency,
+        linger=batch_settings.embedding_batch_linger,
+        rate_limit_retries=batch_settings.embedding_batch_rate_limit_retries,
+    )
+    settings = get_settings().embedding_cache_settings
+    if not settings.embedding_cache_enabled:
+        return embeddings
+    return CachedEmbeddings(
+        embeddings,
+        provider,
+        model,
+        redis_client=get_redis_client(),
+        ttl=settings.embedding_cache_ttl,
+        query_cache_size=settings.query_cache_size,
+        query_ttl=settings.query_cache_ttl,
+    )
+
+
+OAI_COLLECTION = "documents-openai"
+OLLAMA_COLLECTION = "documents-ollama"
+
+
+def get_collection_dimensions():
+    """embedding dimensions of each vector collection"""
+    return {
+        OAI_COLLECTION: get_oai_settings().openai_embedding_dimensions,
+        OLLAMA_COLLECTION: get_ollama_settings().ollama_embeddings_dimensions,
+    }
 
 
 @lru_cache
 def get_oai_vector_store():
     """get pgvector settings"""
-    collection = "documents-openai"
+    collection = OAI_COLLECTION
+    model = get_oai_settings().openai_embedding_model.value
     return PGVector(
-        OpenAIEmbeddings(model=get_oai_settings().openai_embedding_model.value),
+        wrap_embeddings(OpenAIEmbeddings(model=model), Provider.OPENAI, model),
         collection_name=collection,
         connection=get_settings().db_settings.url,
         async_mode=True,
@@ -42,11 +96,13 @@ def get_oai_vector_store():
 @lru_cache
 def get_ollama_vector_store():
     """get pgvector settings"""
-    collection = "documents-ollama"
+    collection = OLLAMA_COLLECTION
+    model = get_ollama_settings().ollama_embeddings_model.value
     return PGVector(
-        OllamaEmbeddings(
-            model=get_ollama_settings().ollama_embeddings_model.value,
-            base_url=get_ollama_settings().ollama_url,
+        wrap_embeddings(
+            OllamaEmbeddings(model=model, base_url=get_ollama_settings().ollama_url),
+            Provider.OLLAMA,
+            model,
         ),
         collection_name=collection,
         connection=get_settings().db_settings.url,
@@ -62,6 +118,18 @@ class ObjectStorageSettings(BaseSettings):
     os_secret_key: str
     os_bucket: str = "document-bucket"
     os_region: str = "eu-west-2"
+    os_part_size: int = 8 * 1024 * 1024  # multipart upload part size in bytes
+    os_upload_concurrency: int = 4  # parts uploaded at once per file
+    os_download_chunk_size: int = 64 * 1024
+    os_bulk_upload_concurrency: int = 8  # files uploaded at once per bulk request
+    os_bulk_upload_max_files: int = 100  # files accepted per bulk request
+    os_presigned_url_ttl: int = 60 * 60  # seconds a signed url is valid for
+    os_presigned_url_margin: int = 5 * 60  # stop reusing a url this close to expiry
+    os_presigned_url_cache_size: int = 4096  # urls kept in process
+    os_max_pool_connections: int = 50
+    os_connect_timeout: float = 5
+    os_read_timeout: float = 60
+    os_max_attempts: int = 3
 
 
 class RedisSettings(BaseSettings):
@@ -71,6 +139,105 @@ class RedisSettings(BaseSettings):
     redis_host: str
     redis_port: int
     redis_db: int
+    consumer_group: str = "dune-workers"
+    consumer_name: str = socket.gethostname()
+    max_deliveries: int = 5  # deliveries before an entry is dead-lettered
+    claim_idle_ms: int = 900_000  # idle time before a pending entry is reclaimed
+    read_block_ms: int = 5_000
+    read_count: int = 10
+
+    @property
+    def dead_letter_stream(self):
+        """Stream that receives entries which could not be processed"""
+        return f"{self.subscription_name}:dead-letter"
+
+
+class WorkerSettings(BaseSettings):
+    """Ingestion worker settings"""
+
+    worker_concurrency: int = 4  # documents processed at once per worker
+    worker_drain_timeout: float = 300  # seconds to finish in-flight work on shutdown
+    embed_retries: int = 3  # attempts per provider before giving up
+    embed_retry_backoff: float = 2.0  # base of the exponential backoff in seconds
+
+
+class ParserSettings(BaseSettings):
+    """Document parsing process pool settings"""
+
+    parser_processes: int = os.cpu_count() or 1
+    parser_timeout: float = 600  # seconds allowed to parse a single file
+    parser_memory_limit_mb: int = 0  # address space cap per process, 0 disables
+    parser_max_tasks_per_child: int = 50  # recycle processes to release memory
+
+
+class ChunkSettings(BaseSettings):
+    """Text splitting settings, sizes are in tokens"""
+
+    chunk_size: int = 512
+    chunk_overlap: int = 64
+    chunk_min_size: int = 64  # smaller fragments are merged into a neighbour
+    chunk_encoding: str = "cl100k_base"
+
+
+class EmbeddingCacheSettings(BaseSettings):
+    """Content hash embedding cache settings"""
+
+    embedding_cache_enabled: bool = True
+    embedding_cache_ttl: int = 60 * 60 * 24 * 30  # seconds since the last hit
+    query_cache_size: int = 1024  # query embeddings kept in process
+    query_cache_ttl: int = 60 * 60 * 24
+
+
+class EmbeddingBatchSettings(BaseSettings):
+    """Embedding request batching settings"""
+
+    embedding_batch_max_tokens: int = 60_000  # estimated tokens per request
+    embedding_batch_min_size: int = 16
+    embedding_batch_max_size: int = 512
+    embedding_batch_in_flight: int = 2  # concurrent requests per provider
+    embedding_batch_target_latency: float = 10.0  # seconds, slower batches shrink
+    embedding_batch_linger: float = 0.05  # seconds to wait for a batch to fill
+    embedding_batch_rate_limit_retries: int = 5
+
+
+class RetrievalSettings(BaseSettings):
+    """Chat retrieval settings"""
+
+    retrieval_k: int = 10  # documents passed to the model
+    hybrid_candidates: int = 20  # results taken from each search before fusion
+    rrf_k: int = 60  # reciprocal rank fusion smoothing constant
+
+
+class ContextSettings(BaseSettings):
+    """Prompt context packing settings, budgets are in tokens"""
+
+    context_budgets: dict[str, int] = {
+        "gpt-4": 4_000,
+        "gpt-4o": 16_000,
+        "deepseek-r1:8b": 4_000,
+        "deepseek-r1:14b": 4_000,
+    }
+    context_default_budget: int = 3_000  # models missing from context_budgets
+    context_dedup_threshold: float = 0.9  # shingle overlap of duplicate chunks
+    context_min_overlap_words: int = 3  # shared words to stitch chunks together
+
+
+class HistorySettings(BaseSettings):
+    """Chat history window settings"""
+
+    history_max_messages: int = 20  # most recent messages sent to the model
+    history_token_budget: int = 2_000  # tokens of the window
+    history_summaries: bool = False  # summarize messages outside the window
+    history_summary_batch: int = 10  # messages to accumulate before summarizing
+    history_summary_max_messages: int = 50  # messages folded in per update
+
+
+class SemanticCacheSettings(BaseSettings):
+    """Chat answer cache settings"""
+
+    semantic_cache_threshold: float = 0.95  # cosine similarity needed for a hit
+    semantic_cache_ttl: int = 60 * 60 * 24
+    semantic_cache_max_entries: int = 50  # answers kept per retrieved context
 
 
 class UserSettings(BaseSettings):
@@ -93,6 +260,16 @@ class Settings(BaseSettings):
     log_level: str = "INFO"
     os_settings: ObjectStorageSettings = ObjectStorageSettings()
     red_settings: RedisSettings = RedisSettings()
+    worker_settings: WorkerSettings = WorkerSettings()
+    parser_settings: ParserSettings = ParserSettings()
+    chunk_settings: ChunkSettings = ChunkSettings()
+    embedding_cache_settings: EmbeddingCacheSettings = EmbeddingCacheSettings()
+    embedding_batch_settings: EmbeddingBatchSettings = EmbeddingBatchSettings()
+    vector_index_settings: VectorIndexSettings = VectorIndexSettings()
+    retrieval_settings: RetrievalSettings = RetrievalSettings()
+    context_settings: ContextSettings = ContextSettings()
+    history_settings: HistorySettings = HistorySettings()
+    semantic_cache_settings: SemanticCacheSettings = SemanticCacheSettings()
     db_settings: DbSettings = DbSettings(
         env_script_location=f"{pathlib.Path(__file__).parent.resolve()}/database/alembic"
     )
@@ -115,39 +292,66 @@ def get_redis_client():
     )
 
 
-async def get_os_client():
-    """return cached minio client"""
-    settings = get_settings()
-    session = aioboto3.Session()
-    async with session.client(
+_OS_CLIENT: "S3Client | None" = None
+
+
+def get_os_client_config(config_class: type[Config] = Config):
+    """connection pool and timeouts shared by the async and sync clients"""
+    settings = get_settings().os_settings
+    return config_class(
+        region_name=settings.os_region,
+        max_pool_connections=settings.os_max_pool_connections,
+        connect_timeout=settings.os_connect_timeout,
+        read_timeout=settings.os_read_timeout,
+        tcp_keepalive=True,
+        retries={"max_attempts": settings.os_max_attempts, "mode": "adaptive"},
+    )
+
+
+@asynccontextmanager
+async def os_client_lifespan():
+    """
+    open the shared object storage client for the lifetime of the app and
+    make sure the bucket exists, once
+    """
+    global _OS_CLIENT
+    settings = get_settings().os_settings
+    async with aioboto3.Session().client(
         "s3",
-        region_name=settings.os_settings.os_region,
-        endpoint_url=settings.os_settings.os_endpoint,
-        aws_access_key_id=settings.os_settings.os_access_key,
-        aws_secret_access_key=settings.os_settings.os_secret_key,
+        endpoint_url=settings.os_endpoint,
+        aws_access_key_id=settings.os_access_key,
+        aws_secret_access_key=settings.os_secret_key,
+        config=get_os_client_config(AioConfig),
     ) as s3:
         try:
-            await s3.head_bucket(Bucket=settings.os_settings.os_bucket)
+            await s3.head_bucket(Bucket=settings.os_bucket)
         except ClientError as e:
             if e.response["Error"]["Code"] == "404":
-                await s3.create_bucket(Bucket=settings.os_settings.os_bucket)
-        yield s3
+                await s3.create_bucket(Bucket=settings.os_bucket)
+        _OS_CLIENT = s3
+        try:
+            yield s3
+        finally:
+            _OS_CLIENT = None
 
 
-os_client_context = asynccontextmanager(get_os_client)
+def get_os_client() -> "S3Client":
+    """return the shared minio client opened by `os_client_lifespan`"""
+    if _OS_CLIENT is None:
+        raise RuntimeError("object storage client used outside os_client_lifespan")
+    return _OS_CLIENT
 
 
 @lru_cache
-def get_s3_file_loader(filepath: str):
-    """return s3 file loader"""
-    settings = get_settings()
-    return S3FileLoader(
-        bucket=settings.os_settings.os_bucket,
-        key=filepath,
-        region_name=settings.os_settings.os_region,
-        endpoint_url=settings.os_settings.os_endpoint,
-        aws_access_key_id=settings.os_settings.os_access_key,
-        aws_secret_access_key=settings.os_settings.os_secret_key,
+def get_sync_os_client():
+    """return cached blocking minio client, one per parser process"""
+    settings = get_settings().os_settings
+    return boto3.client(
+        "s3",
+        endpoint_url=settings.os_endpoint,
+        aws_access_key_id=settings.os_access_key,
+        aws_secret_access_key=settings.os_secret_key,
+        config=get_os_client_config(),
     )
 
 
@@ -189,6 +393,9 @@ async def get_async_session():
         yield session
 
 
+async_session_context = asynccontextmanager(get_async_session)
+
+
 def get_sync_session():
     """
     return a generator of the sync postgres session for use in endpoints.
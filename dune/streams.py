@@ -0,0 +1,147 @@
+"""
+Redis Streams helpers for the document ingestion queue.
+
+Documents are appended to the stream named by `subscription_name` and consumed
+by a consumer group, so every entry is delivered to exactly one worker and
+stays pending until that worker acks it.
+"""
+
+from collections.abc import Collection
+import logging
+from redis.asyncio import Redis
+from redis.exceptions import ResponseError
+from redis.typing import EncodableT, FieldT, StreamIdT
+
+from .schemas import DocMetadataPayload
+from .settings import get_settings
+
+PAYLOAD_FIELD = b"payload"
+
+StreamEntry = tuple[bytes, dict[bytes, bytes]]
+
+
+async def ensure_consumer_group(redis_client: Redis):
+    """create the stream and consumer group if they do not exist yet"""
+    settings = get_settings().red_settings
+    try:
+        await redis_client.xgroup_create(
+            settings.subscription_name, settings.consumer_group, id="0", mkstream=True
+        )
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+async def publish_document(redis_client: Redis, payload: DocMetadataPayload):
+    """append a document to the ingestion stream"""
+    return await redis_client.xadd(
+        get_settings().red_settings.subscription_name,
+        {PAYLOAD_FIELD: payload.model_dump_json()},
+    )
+
+
+async def publish_documents(redis_client: Redis, payloads: list[DocMetadataPayload]):
+    """append many documents to the ingestion stream in one round trip"""
+    if not payloads:
+        return []
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for payload in payloads:
+            pipe.xadd(
+                get_settings().red_settings.subscription_name,
+                {PAYLOAD_FIELD: payload.model_dump_json()},
+            )
+        return await pipe.execute()
+
+
+async def read_new_entries(redis_client: Redis, count: int) -> list[StreamEntry]:
+    """read entries that have never been delivered to this consumer group"""
+    settings = get_settings().red_settings
+    response = await redis_client.xreadgroup(
+        settings.consumer_group,
+        settings.consumer_name,
+        {settings.subscription_name: ">"},
+        count=count,
+        block=settings.read_block_ms,
+    )
+    return [entry for _, entries in response for entry in entries]
+
+
+async def claim_stale_entries(
+    redis_client: Redis, count: int, in_flight: Collection[bytes] = ()
+) -> list[StreamEntry]:
+    """
+    Take over entries left pending by consumers that died or stalled.
+    Entries delivered more than `max_deliveries` times are dead-lettered instead,
+    and entries this worker is still processing (`in_flight`) are skipped.
+    """
+    settings = get_settings().red_settings
+    response = await redis_client.xautoclaim(
+        settings.subscription_name,
+        settings.consumer_group,
+        settings.consumer_name,
+        min_idle_time=settings.claim_idle_ms,
+        start_id="0-0",
+        count=count,
+    )
+    entries: list[StreamEntry] = []
+    for entry_id, fields in response[1]:
+        if entry_id is None or entry_id in in_flight:
+            continue
+        pending = await redis_client.xpending_range(
+            settings.subscription_name,
+            settings.consumer_group,
+            min=entry_id,
+            max=entry_id,
+            count=1,
+        )
+        if pending and pending[0]["times_delivered"] > settings.max_deliveries:
+            await dead_letter_entry(
+                redis_client, entry_id, fields, "max deliveries exceeded"
+            )
+            continue
+        entries.append((entry_id, fields))
+    return entries
+
+
+async def refresh_claims(redis_client: Redis, entry_ids: list[bytes]):
+    """
+    reset the idle time of entries this worker is still processing, so they are
+    not reclaimed by other workers. JUSTID leaves the delivery count alone.
+    """
+    if not entry_ids:
+        return
+    settings = get_settings().red_settings
+    message_ids: list[StreamIdT] = list(entry_ids)
+    await redis_client.xclaim(
+        settings.subscription_name,
+        settings.consumer_group,
+        settings.consumer_name,
+        min_idle_time=0,
+        message_ids=message_ids,
+        justid=True,
+    )
+
+
+async def ack_entry(redis_client: Redis, entry_id: bytes):
+    """acknowledge and drop a processed entry"""
+    settings = get_settings().red_settings
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.xack(settings.subscription_name, settings.consumer_group, entry_id)
+        pipe.xdel(settings.subscription_name, entry_id)
+        await pipe.execute()
+
+
+async def dead_letter_entry(
+    redis_client: Redis, entry_id: bytes, fields: dict[bytes, bytes], reason: str
+):
+    """move an entry to the dead-letter stream and ack it on the main stream"""
+    settings = get_settings().red_settings
+    logging.error("Dead-lettering stream entry %s: %s", entry_id, reason)
+    dead_letter: dict[FieldT, EncodableT] = dict(fields.items())
+    dead_letter[b"entry_id"] = entry_id
+    dead_letter[b"reason"] = reason
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.xadd(settings.dead_letter_stream, dead_letter)
+        pipe.xack(settings.subscription_name, settings.consumer_group, entry_id)
+        pipe.xdel(settings.subscription_name, entry_id)
+        await pipe.execute()
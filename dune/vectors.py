@@ -0,0 +1,209 @@
+"""
+Bulk insertion into and indexed search of the PGVector collections
+"""
+
+import asyncio
+from collections import defaultdict
+from uuid import UUID, uuid4
+
+from langchain_core.documents import Document
+from langchain_postgres import PGVector
+from pgvector.psycopg.vector import register_vector_info
+from psycopg import AsyncConnection
+from psycopg.types import TypeInfo
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database.config import get_async_engine
+from .database.vector_indexes import (
+    TEXT_SEARCH_CONFIG,
+    USER_PREDICATE,
+    collection_predicate,
+    distance_expression,
+    search_settings_stmt,
+)
+from .schemas import RetrievalMode
+from .settings import async_session_context, get_collection_dimensions, get_settings
+
+COPY_EMBEDDINGS = (
+    "COPY langchain_pg_embedding (id, collection_id, embedding, document, cmetadata)"
+    " FROM STDIN (FORMAT BINARY)"
+)
+COPY_TYPES = ["varchar", "uuid", "vector", "varchar", "jsonb"]
+DELETE_DOCUMENT_EMBEDDINGS = (
+    "DELETE FROM langchain_pg_embedding WHERE collection_id = %s"
+    " AND cmetadata->>'document_id' = ANY(%s)"
+)
+
+_COLLECTION_IDS: dict[str, UUID] = {}
+_VECTOR_INFO: TypeInfo | None = None
+
+
+async def get_collection_id(store: PGVector) -> UUID:
+    """return the uuid of a store's collection, creating the collection if needed"""
+    if store.collection_name not in _COLLECTION_IDS:
+        await store.acreate_collection()
+        async with store.session_maker() as session:
+            collection = await store.aget_collection(session)
+        _COLLECTION_IDS[store.collection_name] = collection.uuid
+    return _COLLECTION_IDS[store.collection_name]
+
+
+async def register_vector(conn: AsyncConnection):
+    """register the binary vector dumper, looking the type up only once"""
+    global _VECTOR_INFO
+    if _VECTOR_INFO is None:
+        _VECTOR_INFO = await TypeInfo.fetch(conn, "vector")
+    register_vector_info(conn, _VECTOR_INFO)
+
+
+async def bulk_add_documents(store: PGVector, documents: list[Document]) -> list[str]:
+    """
+    Embed documents with the store's embeddings and stream the rows into its
+    collection with a binary COPY, in a single transaction. Chunks left from
+    an earlier ingestion of the same documents are deleted in that transaction,
+    so a redelivered entry replaces them instead of duplicating them.
+    """
+    if not documents:
+        return []
+    vectors = await store.embeddings.aembed_documents(
+        [document.page_content for document in documents]
+    )
+    collection_id = await get_collection_id(store)
+    ids = [document.id or str(uuid4()) for document in documents]
+    document_ids = list(
+        {
+            str(document.metadata["document_id"])
+            for document in documents
+            if document.metadata.get("document_id")
+        }
+    )
+
+    engine = get_async_engine(get_settings().db_settings)
+    async with engine.connect() as sa_conn:
+        raw_conn = await sa_conn.get_raw_connection()
+        conn: AsyncConnection = raw_conn.driver_connection  # type: ignore[assignment]
+        await register_vector(conn)
+        async with conn.transaction():
+            async with conn.cursor() as cursor:
+                if document_ids:
+                    await cursor.execute(
+                        DELETE_DOCUMENT_EMBEDDINGS, (collection_id, document_ids)
+                    )
+                async with cursor.copy(COPY_EMBEDDINGS) as copy:
+                    copy.set_types(COPY_TYPES)
+                    for id_, document, vector in zip(ids, documents, vectors):
+                        await copy.write_row(
+                            (
+                                id_,
+                                collection_id,
+                                vector,
+                                document.page_content,
+                                document.metadata,
+                            )
+                        )
+    return ids
+
+
+async def similarity_search(
+    session: AsyncSession, store: PGVector, query: str, k: int, user_id: UUID
+) -> list[Document]:
+    """
+    Nearest neighbour search over a user's chunks in a store's collection,
+    written against the collection's partial vector index instead of a
+    sequential scan.
+    """
+    settings = get_settings().vector_index_settings
+    collection_id = await get_collection_id(store)
+    dimensions = get_collection_dimensions()[store.collection_name]
+    embedding = await store.embeddings.aembed_query(query)
+    distance = distance_expression(
+        dimensions, settings.vector_distance_metric, "embedding"
+    )
+    await session.execute(search_settings_stmt(settings))
+    result = await session.execute(
+        text(
+            "SELECT id, document, cmetadata FROM langchain_pg_embedding"
+            f" WHERE {collection_predicate(collection_id)}"
+            f" AND {USER_PREDICATE}"
+            f" ORDER BY {distance} LIMIT :k"
+        ),
+        {"embedding": str(embedding), "k": k, "user_id": str(user_id)},
+    )
+    return [
+        Document(id=row.id, page_content=row.document, metadata=row.cmetadata or {})
+        for row in result
+    ]
+
+
+async def text_search(
+    session: AsyncSession, store: PGVector, query: str, k: int, user_id: UUID
+) -> list[Document]:
+    """
+    Full text search over a user's chunks in a store's collection, served by
+    the GIN index on the generated document_tsv column and ranked by ts_rank_cd.
+    """
+    collection_id = await get_collection_id(store)
+    tsquery = f"websearch_to_tsquery('{TEXT_SEARCH_CONFIG}', :query)"
+    result = await session.execute(
+        text(
+            "SELECT id, document, cmetadata FROM langchain_pg_embedding"
+            f" WHERE {collection_predicate(collection_id)}"
+            f" AND {USER_PREDICATE}"
+            f" AND document_tsv @@ {tsquery}"
+            f" ORDER BY ts_rank_cd(document_tsv, {tsquery}) DESC LIMIT :k"
+        ),
+        {"query": query, "k": k, "user_id": str(user_id)},
+    )
+    return [
+        Document(id=row.id, page_content=row.document, metadata=row.cmetadata or {})
+        for row in result
+    ]
+
+
+def reciprocal_rank_fusion(
+    rankings: list[list[Document]], k: int, limit: int
+) -> list[Document]:
+    """merge ranked result lists, scoring each document by sum(1 / (k + rank))"""
+    scores: dict[str, float] = defaultdict(float)
+    documents: dict[str, Document] = {}
+    for ranking in rankings:
+        for rank, document in enumerate(ranking, start=1):
+            scores[document.id] += 1 / (k + rank)
+            documents.setdefault(document.id, document)
+    ordered = sorted(scores, key=scores.__getitem__, reverse=True)
+    return [documents[id_] for id_ in ordered[:limit]]
+
+
+async def hybrid_search(
+    session: AsyncSession, store: PGVector, query: str, k: int, user_id: UUID
+) -> list[Document]:
+    """
+    Run the vector and full text searches concurrently, each on its own
+    connection, and fuse the results with reciprocal rank fusion.
+    """
+    settings = get_settings().retrieval_settings
+    candidates = max(k, settings.hybrid_candidates)
+    async with async_session_context() as text_session:
+        rankings = await asyncio.gather(
+            similarity_search(session, store, query, candidates, user_id),
+            text_search(text_session, store, query, candidates, user_id),
+        )
+    return reciprocal_rank_fusion(list(rankings), settings.rrf_k, k)
+
+
+async def retrieve(
+    session: AsyncSession,
+    store: PGVector,
+    query: str,
+    k: int,
+    user_id: UUID,
+    mode: RetrievalMode,
+) -> list[Document]:
+    """retrieve a user's chunks relevant to a query"""
+    search = {
+        RetrievalMode.VECTOR: similarity_search,
+        RetrievalMode.TEXT: text_search,
+        RetrievalMode.HYBRID: hybrid_search,
+    }[mode]
+    return await search(session, store, query, k, user_id)
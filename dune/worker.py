@@ -1,20 +1,43 @@
 """
-Worker for object analysis using Redis Pub/Sub
+Worker for object analysis using Redis Streams
 """
 
 import asyncio
+from functools import partial
 import signal
 import logging
 
 import openai
+from pydantic import ValidationError
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from langchain_core.documents import Document
+from .database.models import DocumentModel
 from .settings import (
+    async_session_context,
     get_oai_vector_store,
     get_ollama_vector_store,
-    get_s3_file_loader,
     get_settings,
     get_redis_client,
 )
-from .schemas import RedisMessage, RedisMessageType, DocMetadataPayload
+from .parsing import parse_document, shutdown_parser_pool, start_parser_pool
+from .schemas import DocMetadataPayload, EmbeddingStatus, Provider
+from .vectors import bulk_add_documents
+from .semantic_cache import invalidate_document
+from .streams import (
+    PAYLOAD_FIELD,
+    ack_entry,
+    claim_stale_entries,
+    dead_letter_entry,
+    ensure_consumer_group,
+    read_new_entries,
+    refresh_claims,
+)
+
+VECTOR_STORES = {
+    Provider.OPENAI: get_oai_vector_store,
+    Provider.OLLAMA: get_ollama_vector_store,
+}
 
 
 async def work():
@@ -23,47 +46,207 @@ async def work():
     signal.signal(signal.SIGINT, lambda _, __: event.set())
     signal.signal(signal.SIGTERM, lambda _, __: event.set())
 
-    listener_task = asyncio.create_task(pubsub_listener())
-    await event.wait()
-    listener_task.cancel()
+    check_claim_idle_time()
+    await start_parser_pool()
     try:
-        await listener_task
-    except asyncio.CancelledError:
-        logging.info("Listener task cancelled.")
-
+        await stream_listener(event)
+    finally:
+        shutdown_parser_pool()
     logging.info("Shutdown complete.")
 
 
-async def pubsub_listener():
+def check_claim_idle_time():
     """
-    Asynchronous Redis Pub/Sub listener
+    Entries are only reclaimed once idle for `claim_idle_ms`, which has to
+    outlast the longest a document can take: the parser timeout plus the
+    embedding retry backoff.
     """
-    channel_name = get_settings().red_settings.subscription_name
+    settings = get_settings()
+    worker_settings = settings.worker_settings
+    longest = settings.parser_settings.parser_timeout + sum(
+        worker_settings.embed_retry_backoff**attempt
+        for attempt in range(1, worker_settings.embed_retries)
+    )
+    if settings.red_settings.claim_idle_ms <= longest * 1000:
+        raise ValueError(
+            f"claim_idle_ms ({settings.red_settings.claim_idle_ms}) must be greater"
+            f" than the longest processing time ({longest * 1000:.0f} ms)"
+        )
+
+
+async def stream_listener(stop: asyncio.Event):
+    """
+    Asynchronous Redis Streams consumer.
+    Entries stay pending until processed successfully, so documents published
+    while no worker is running are picked up on start and entries abandoned by
+    a crashed worker are reclaimed by the others.
+
+    Up to `worker_concurrency` entries are processed at once. No new entries are
+    read while the pool is full, and once `stop` is set the in-flight entries
+    are given `worker_drain_timeout` seconds to finish. Their claims are
+    refreshed all along so other workers do not reclaim them.
+    """
+    settings = get_settings()
+    red_settings = settings.red_settings
+    concurrency = settings.worker_settings.worker_concurrency
     redis_client = get_redis_client()
-    pubsub = redis_client.pubsub()
-    await pubsub.subscribe(channel_name)
-    logging.info("Subscribed to channel: %s", channel_name)
+    await ensure_consumer_group(redis_client)
+    logging.info(
+        "Consuming stream %s as %s in group %s with concurrency %s",
+        red_settings.subscription_name,
+        red_settings.consumer_name,
+        red_settings.consumer_group,
+        concurrency,
+    )
+
+    tasks: dict[bytes, asyncio.Task] = {}
 
+    def forget(entry_id: bytes, _: asyncio.Task):
+        tasks.pop(entry_id, None)
+
+    stopping = asyncio.create_task(stop.wait())
+    heartbeat = asyncio.create_task(keep_claims(redis_client, tasks))
     try:
-        async for message in pubsub.listen():
-            message_model = RedisMessage.model_validate(message)
-            if message_model.type == RedisMessageType.MESSAGE and isinstance(
-                message_model.data, bytes
-            ):
-                logging.info("Received message from channel '%s'", channel_name)
-                metad = DocMetadataPayload.model_validate_json(
-                    message_model.data.decode("utf-8")
+        while not stop.is_set():
+            if len(tasks) >= concurrency:
+                await asyncio.wait(
+                    {stopping, *tasks.values()}, return_when=asyncio.FIRST_COMPLETED
                 )
-                loader = get_s3_file_loader(metad.path)
-                documents = await loader.aload()
-                try:
-                    await get_oai_vector_store().aadd_documents(documents)
-                except openai.AuthenticationError:
-                    logging.warning("OpenAi not authenticated, supressing...")
-                try:
-                    await get_ollama_vector_store().aadd_documents(documents)
-                except Exception:
-                    logging.exception("Failed to add ollama docs")
-                logging.info("Document processed: %s", metad.id_)
+                continue
+            count = min(concurrency - len(tasks), red_settings.read_count)
+            entries = await claim_stale_entries(redis_client, count, tasks.keys())
+            if not entries:
+                entries = await read_new_entries(redis_client, count)
+            for entry_id, fields in entries:
+                if entry_id in tasks:
+                    continue
+                task = asyncio.create_task(handle_entry(redis_client, entry_id, fields))
+                tasks[entry_id] = task
+                task.add_done_callback(partial(forget, entry_id))
+
+        await drain(set(tasks.values()), settings.worker_settings.worker_drain_timeout)
     finally:
-        await pubsub.close()
+        heartbeat.cancel()
+
+
+async def keep_claims(redis_client: Redis, tasks: dict[bytes, asyncio.Task]):
+    """refresh the claims of in-flight entries well within `claim_idle_ms`"""
+    interval = get_settings().red_settings.claim_idle_ms / 3000
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await refresh_claims(redis_client, list(tasks))
+        except RedisError:
+            logging.exception("Failed to refresh the claims of in-flight entries")
+
+
+async def drain(tasks: set[asyncio.Task], timeout: float):
+    """
+    Wait for in-flight entries to finish.
+    Entries still running after the timeout are cancelled and left pending,
+    so another worker reclaims them.
+    """
+    if not tasks:
+        return
+    logging.info("Draining %s in-flight documents", len(tasks))
+    _, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.wait(pending)
+        logging.warning("Cancelled %s documents that did not drain", len(pending))
+
+
+async def handle_entry(redis_client: Redis, entry_id: bytes, fields: dict):
+    """process a single stream entry and ack it on success"""
+    try:
+        metad = DocMetadataPayload.model_validate_json(fields[PAYLOAD_FIELD])
+    except (KeyError, ValidationError):
+        await dead_letter_entry(redis_client, entry_id, fields, "invalid payload")
+        return
+    try:
+        await process_document(metad)
+    except Exception:
+        logging.exception("Failed to process document %s, will retry", metad.id_)
+        return
+    await ack_entry(redis_client, entry_id)
+
+
+async def process_document(metad: DocMetadataPayload):
+    """load and chunk a document, then embed it with every provider"""
+    documents = await parse_document(metad.path)
+    for document in documents:
+        document.metadata = {
+            **document.metadata,
+            "user_id": str(metad.user_id),
+            "document_id": str(metad.id_),
+        }
+    async with async_session_context() as session:
+        await session.execute(
+            DocumentModel.set_chunk_count_stmt(metad.id_, len(documents))
+        )
+        embedded = await session.scalar(
+            DocumentModel.get_embedding_status_stmt(metad.id_)
+        )
+    # a redelivered entry only retries the providers that failed before
+    providers = [
+        provider
+        for provider in VECTOR_STORES
+        if (embedded or {}).get(provider) != EmbeddingStatus.SUCCESS
+    ]
+    results = await asyncio.gather(
+        *(embed_documents(metad, provider, documents) for provider in providers),
+        return_exceptions=True,
+    )
+    await invalidate_document(get_redis_client(), str(metad.id_))
+    failed = [
+        provider
+        for provider, result in zip(providers, results)
+        if isinstance(result, BaseException)
+    ]
+    if failed:
+        raise RuntimeError(
+            f"Document {metad.id_} was not embedded by {', '.join(failed)}"
+        )
+    logging.info("Document processed: %s (%s chunks)", metad.id_, len(documents))
+
+
+async def embed_documents(
+    metad: DocMetadataPayload, provider: Provider, documents: list[Document]
+):
+    """
+    Add documents to one provider's collection, retrying with backoff.
+    The outcome is recorded on the document; once the retries are used up the
+    last error is raised so the stream entry stays pending and is retried.
+    A provider without credentials is recorded as failed but not retried.
+    """
+    settings = get_settings().worker_settings
+    status = EmbeddingStatus.FAILED
+    error: Exception | None = None
+    for attempt in range(1, settings.embed_retries + 1):
+        try:
+            await bulk_add_documents(VECTOR_STORES[provider](), documents)
+            status = EmbeddingStatus.SUCCESS
+            error = None
+            break
+        except openai.AuthenticationError:
+            logging.warning("OpenAi not authenticated, supressing...")
+            error = None
+            break
+        except Exception as e:
+            error = e
+            logging.exception(
+                "Failed to add %s docs, attempt %s/%s",
+                provider,
+                attempt,
+                settings.embed_retries,
+            )
+            if attempt < settings.embed_retries:
+                await asyncio.sleep(settings.embed_retry_backoff**attempt)
+
+    async with async_session_context() as session:
+        await session.execute(
+            DocumentModel.set_embedding_status_stmt(metad.id_, provider, status)
+        )
+    if error is not None:
+        raise error
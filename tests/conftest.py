@@ -0,0 +1,14 @@
+"""test configuration"""
+
+import os
+
+# settings are read when dune is imported, the tests never reach these services
+for name, value in {
+    "OS_ACCESS_KEY": "test",
+    "OS_SECRET_KEY": "test",
+    "SUBSCRIPTION_NAME": "test",
+    "REDIS_HOST": "localhost",
+    "REDIS_PORT": "6379",
+    "REDIS_DB": "0",
+}.items():
+    os.environ.setdefault(name, value)
@@ -0,0 +1,57 @@
+"""tests of stitching retrieved chunks back together"""
+
+from langchain_core.documents import Document
+
+from dune.context import join_overlapping, merge_adjacent
+
+
+def test_overlapping_chunks_are_joined_once():
+    first = "The invoice is due at the end of the month."
+    second = "at the end of the month. Late payments are charged."
+
+    joined = join_overlapping(first, second, min_words=3)
+
+    assert (
+        joined
+        == "The invoice is due at the end of the month. Late payments are charged."
+    )
+
+
+def test_overlap_cutting_through_a_word_is_not_dropped():
+    assert (
+        join_overlapping("Total due for the", "end of month: 42")
+        == "Total due for the\nend of month: 42"
+    )
+    assert (
+        join_overlapping("Invoice 1234", "4 items shipped")
+        == "Invoice 1234\n4 items shipped"
+    )
+
+
+def test_overlap_shorter_than_the_minimum_is_not_dropped():
+    first = "Payment received for the"
+    second = "the order shipped today"
+
+    assert join_overlapping(first, second, min_words=3) == f"{first}\n{second}"
+    assert (
+        join_overlapping(first, second)
+        == "Payment received for the order shipped today"
+    )
+
+
+def test_consecutive_chunks_of_a_document_are_merged():
+    docs = [
+        Document(
+            id=str(index),
+            page_content=content,
+            metadata={"document_id": "doc", "chunk_index": index},
+        )
+        for index, content in enumerate(
+            ["one two three four", "two three four five six", "seven eight"]
+        )
+    ]
+
+    (passage,) = merge_adjacent(docs, min_overlap_words=3)
+
+    assert passage.content == "one two three four five six\nseven eight"
+    assert passage.ids == ["0", "1", "2"]
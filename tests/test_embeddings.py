@@ -0,0 +1,152 @@
+"""tests of the adaptive embedding batcher"""
+
+import asyncio
+
+import pytest
+from langchain_core.embeddings import Embeddings
+
+from dune.embeddings import BatchingEmbeddings
+
+
+class RateLimitError(Exception):
+    """provider error carrying an HTTP status like openai's"""
+
+    status_code = 429
+
+
+class FakeEmbeddings(Embeddings):
+    """embeds a text as [its number], recording the size of every request"""
+
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.batches: list[int] = []
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [[float(text)] for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return [float(text)]
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.batches.append(len(texts))
+        await asyncio.sleep(0)
+        if self.failures:
+            self.failures -= 1
+            raise RateLimitError()
+        return self.embed_documents(texts)
+
+
+def batcher(embeddings: Embeddings, **kwargs) -> BatchingEmbeddings:
+    options = {
+        "max_batch_tokens": 10_000,
+        "min_batch_size": 1,
+        "max_batch_size": 8,
+        "max_in_flight": 1,
+        "target_latency": 10.0,
+        "linger": 0.01,
+        "rate_limit_retries": 1,
+    }
+    return BatchingEmbeddings(embeddings, **options | kwargs)
+
+
+def texts(start: int, stop: int) -> list[str]:
+    return [str(i) for i in range(start, stop)]
+
+
+@pytest.mark.asyncio
+async def test_batches_grow_after_fast_responses():
+    fake = FakeEmbeddings()
+    embeddings = batcher(fake)
+
+    await embeddings.aembed_documents(texts(0, 40))
+
+    assert fake.batches[0] == 1
+    assert max(fake.batches) == 8
+    assert embeddings.batch_size == 8
+
+
+@pytest.mark.asyncio
+async def test_rate_limited_batches_are_retried():
+    fake = FakeEmbeddings(failures=1)
+    embeddings = batcher(fake)
+    embeddings.batch_size = 8
+
+    vectors = await embeddings.aembed_documents(texts(0, 8))
+
+    assert fake.batches == [8, 8]
+    assert vectors == [[float(i)] for i in range(8)]
+
+
+@pytest.mark.asyncio
+async def test_batches_shrink_after_rate_limits():
+    fake = FakeEmbeddings(failures=2)
+    embeddings = batcher(fake, rate_limit_retries=1)
+    embeddings.batch_size = 8
+
+    with pytest.raises(RateLimitError):
+        await embeddings.aembed_documents(texts(0, 8))
+    assert embeddings.batch_size == 4
+
+    await embeddings.aembed_documents(texts(0, 8))
+    assert fake.batches[2] == 4
+
+
+@pytest.mark.asyncio
+async def test_slow_responses_shrink_batches():
+    fake = FakeEmbeddings()
+    embeddings = batcher(fake, target_latency=-1.0)
+    embeddings.batch_size = 8
+
+    await embeddings.aembed_documents(texts(0, 8))
+    assert embeddings.batch_size == 4
+
+    await embeddings.aembed_documents(texts(0, 8))
+    assert fake.batches == [8, 4, 4]
+    assert embeddings.batch_size == 1
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_get_their_own_vectors_in_order():
+    fake = FakeEmbeddings()
+    embeddings = batcher(fake, max_in_flight=3)
+
+    results = await asyncio.gather(
+        *(
+            embeddings.aembed_documents(texts(start, start + 25))
+            for start in (0, 100, 200)
+        )
+    )
+
+    for start, vectors in zip((0, 100, 200), results):
+        assert vectors == [[float(i)] for i in range(start, start + 25)]
+    assert sum(fake.batches) == 75
+    assert max(fake.batches) > 1
+
+
+@pytest.mark.asyncio
+async def test_batches_respect_the_token_limit():
+    fake = FakeEmbeddings()
+    embeddings = batcher(fake, max_batch_tokens=4)
+    embeddings.batch_size = 8
+
+    vectors = await embeddings.aembed_documents(texts(0, 8))
+
+    # every single digit text is estimated at one token
+    assert max(fake.batches) == 4
+    assert vectors == [[float(i)] for i in range(8)]
+
+
+class ShortEmbeddings(FakeEmbeddings):
+    """drops the last vector of every request"""
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        vectors = await super().aembed_documents(texts)
+        return vectors[:-1]
+
+
+@pytest.mark.asyncio
+async def test_missing_vectors_fail_the_whole_batch():
+    embeddings = batcher(ShortEmbeddings())
+
+    with pytest.raises(ValueError):
+        await asyncio.wait_for(embeddings.aembed_documents(texts(0, 4)), 1)